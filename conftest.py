@@ -0,0 +1 @@
+# Makes the repository root importable (`core`, `sandbox`) when the tests are run with plain `pytest`.
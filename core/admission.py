@@ -0,0 +1,164 @@
+"""Admission control for app creation: a global cap on concurrent creates and live sandboxes, with a FIFO queue."""
+
+import contextlib
+import math
+import time
+import typing as t
+
+import modal
+
+from core.locks import DictLock, LockTimeout
+
+MAX_IN_FLIGHT_CREATES = 32
+MAX_LIVE_SANDBOXES = 1000
+# Creates waiting for a slot; further requests are turned away with a 429.
+MAX_QUEUE_LENGTH = 200
+# Typical create duration, used to estimate queue waits and Retry-After.
+ESTIMATED_CREATE_SECONDS = 30.0
+# A create holding a slot longer than this is assumed lost (e.g. its container died) and the slot is reclaimed.
+SLOT_LEASE_TIMEOUT = 15 * 60
+
+STATE_KEY = "state"  # {"queue": [job_id, ...], "in_flight": {job_id: started_at}}
+LOCK_KEY = "lock"
+LOCK_TIMEOUT = 10.0  # A lock held longer than this is presumed abandoned and taken over.
+# Each create takes the lock twice (admission and release), for a get and a put each time, so a burst
+# drains quickly; a waiter gives up (and the request gets a 429) only well after that.
+LOCK_WAIT = 15.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when creation is saturated; `retry_after` is a suggested wait in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Admits create jobs into a bounded number of concurrent creates, first come first served.
+
+    The queue and the slots in use live in one Modal Dict entry, shared by every controller
+    container and the create function, and are only changed under a `DictLock`. A create takes it
+    once to queue (and, given a free slot, start) and once to give its slot to the next job. Slots
+    are leases: one whose create never released it expires after `SLOT_LEASE_TIMEOUT`.
+    """
+
+    def __init__(
+        self,
+        state_dict: modal.Dict,
+        max_in_flight: int = MAX_IN_FLIGHT_CREATES,
+        max_live_sandboxes: int = MAX_LIVE_SANDBOXES,
+        max_queue_length: int = MAX_QUEUE_LENGTH,
+    ):
+        self.state_dict = state_dict
+        self.max_in_flight = max_in_flight
+        self.max_live_sandboxes = max_live_sandboxes
+        self.max_queue_length = max_queue_length
+
+    @contextlib.asynccontextmanager
+    async def _locked(self) -> t.AsyncIterator[dict]:
+        lock = DictLock(self.state_dict, LOCK_KEY, timeout=LOCK_TIMEOUT, wait=LOCK_WAIT)
+        try:
+            await lock.acquire()
+        except LockTimeout:
+            raise AdmissionRejected("Admission state is busy", retry_after=1)
+        try:
+            state = await self.state_dict.get.aio(STATE_KEY, {"queue": [], "in_flight": {}})
+            yield state
+            await self.state_dict.put.aio(STATE_KEY, state)
+        finally:
+            await lock.release()
+
+    def _retry_after(self, waiting: int) -> int:
+        return max(1, math.ceil((waiting / max(self.max_in_flight, 1) + 1) * ESTIMATED_CREATE_SECONDS))
+
+    @staticmethod
+    def _expire_leases(state: dict) -> None:
+        now = time.time()
+        for job_id, started_at in list(state["in_flight"].items()):
+            if now - started_at > SLOT_LEASE_TIMEOUT:
+                print(f"[AdmissionController] Reclaiming the slot of job {job_id}")
+                del state["in_flight"][job_id]
+
+    async def enqueue(
+        self, job_id: str, live_sandboxes: int, start: t.Optional[t.Callable[[str], t.Awaitable[None]]] = None
+    ) -> t.Optional[int]:
+        """Put a job at the back of the queue; with `start`, also hand out free slots as `dispatch` does.
+
+        Returns the job's 1-based queue position, or None if it got a slot. `live_sandboxes` should
+        count warm pool sandboxes too. Raises `AdmissionRejected` if the queue is full or there are
+        already too many live sandboxes.
+        """
+        async with self._locked() as state:
+            self._expire_leases(state)
+            waiting = len(state["queue"])
+            if live_sandboxes + len(state["in_flight"]) >= self.max_live_sandboxes:
+                raise AdmissionRejected("Too many live sandboxes", self._retry_after(waiting))
+            if waiting >= self.max_queue_length:
+                raise AdmissionRejected("Too many apps are being created", self._retry_after(waiting))
+            state["queue"].append(job_id)
+            admitted = self._admit(state) if start is not None else []
+            position = state["queue"].index(job_id) + 1 if job_id in state["queue"] else None
+        if start is not None:
+            await self._start(admitted, start)
+        return position
+
+    async def position(self, job_id: str) -> t.Optional[int]:
+        """1-based position of a queued job, or None once it has a slot (or was never queued)."""
+        state = await self.state_dict.get.aio(STATE_KEY, {"queue": [], "in_flight": {}})
+        try:
+            return state["queue"].index(job_id) + 1
+        except ValueError:
+            return None
+
+    def estimated_wait(self, position: int) -> float:
+        return math.ceil(position / max(self.max_in_flight, 1)) * ESTIMATED_CREATE_SECONDS
+
+    def _admit(self, state: dict) -> list[str]:
+        admitted = []
+        while state["queue"] and len(state["in_flight"]) < self.max_in_flight:
+            job_id = state["queue"].pop(0)
+            state["in_flight"][job_id] = time.time()
+            admitted.append(job_id)
+        return admitted
+
+    async def _start(self, admitted: list[str], start: t.Callable[[str], t.Awaitable[None]]) -> None:
+        for job_id in admitted:
+            try:
+                await start(job_id)
+            except Exception as e:
+                print(f"[AdmissionController] Failed to start job {job_id}: {e}")
+                # Its slot goes straight to the next queued job rather than waiting for the cleanup dispatch.
+                await self.release(job_id, start)
+
+    async def dispatch(self, start: t.Callable[[str], t.Awaitable[None]]) -> list[str]:
+        """Give free slots to the jobs at the front of the queue and `start` each of them.
+
+        A job whose start fails hands its slot to the next queued job straight away.
+        """
+        async with self._locked() as state:
+            self._expire_leases(state)
+            admitted = self._admit(state)
+        await self._start(admitted, start)
+        return admitted
+
+    async def release(self, job_id: str, start: t.Optional[t.Callable[[str], t.Awaitable[None]]] = None) -> None:
+        """Free the slot (or queue place) held by a job; with `start`, hand it to the next queued job."""
+        async with self._locked() as state:
+            state["in_flight"].pop(job_id, None)
+            if job_id in state["queue"]:
+                state["queue"].remove(job_id)
+            admitted = self._admit(state) if start is not None else []
+        if start is not None:
+            await self._start(admitted, start)
+
+    async def stats(self) -> dict:
+        state = await self.state_dict.get.aio(STATE_KEY, {"queue": [], "in_flight": {}})
+        return {
+            "queued": len(state["queue"]),
+            "in_flight": len(state["in_flight"]),
+            "max_in_flight": self.max_in_flight,
+            "max_live_sandboxes": self.max_live_sandboxes,
+            "max_queue_length": self.max_queue_length,
+        }
@@ -0,0 +1,216 @@
+"""Content-addressed cache of generated initial components, shared across containers in a Modal Dict."""
+
+import asyncio
+import hashlib
+import re
+import time
+import typing as t
+
+import modal
+
+from core.locks import DictLock
+from core.patch import is_component_valid
+from core.prompt import COMPONENT_MODEL, PROMPT_TEMPLATE_VERSION
+from core.similarity import SIMILARITY_THRESHOLD, PromptIndex, signature
+
+CACHE_MAX_ENTRIES = 2000
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL = 7 * 24 * 3600
+# Hits only refresh an entry's recency in the index when it is older than this, so a popular prompt
+# doesn't turn every create into an index write.
+ACCESS_RESOLUTION = 600
+
+INDEX_KEY = "__index__"  # cache key -> [size in bytes, last access, created at]
+STATS_KEY = "__stats__"  # {"hits": int, "misses": int, "similar_hits": int}
+SIGNATURES_KEY = "__signatures__"  # cache key -> MinHash signature of the normalized prompt
+# Guards read-modify-writes of the index and signatures, and of the counters.
+INDEX_LOCK_KEY = "__index_lock__"
+STATS_LOCK_KEY = "__stats_lock__"
+LOCK_TIMEOUT = 10.0
+LOCK_WAIT = 10.0
+
+# Hit/miss counts not yet added to the shared counters, and the background task adding them.
+_pending_stats: dict[str, int] = {}
+_flush_task: t.Optional[asyncio.Task] = None
+# Background index updates, kept referenced until they finish.
+_background: set[asyncio.Task] = set()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivially different prompts share an entry."""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip(".!?").strip().lower()
+
+
+def cache_key(prompt: str) -> str:
+    material = f"{COMPONENT_MODEL}|{PROMPT_TEMPLATE_VERSION}|{normalize_prompt(prompt)}"
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ComponentCache:
+    """Maps a normalized prompt to the component and explanation generated for it.
+
+    Entries live under `entry_{key}`; a single index holds their sizes and access times and is used to
+    evict expired entries, then least recently used ones, whenever the cache is over its entry or byte
+    budget. The index and the signatures are only rewritten under a `DictLock`, so concurrent creates
+    can't drop each other's entries from them; the entries themselves are written whole and never
+    partially. Lookups don't wait on any of this: recency updates and hit/miss counts are written in
+    the background, the counts batched per container.
+    """
+
+    def __init__(
+        self,
+        cache_dict: modal.Dict,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        ttl: float = CACHE_TTL,
+    ):
+        self.cache_dict = cache_dict
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _lock(self, key: str) -> DictLock:
+        return DictLock(self.cache_dict, key, timeout=LOCK_TIMEOUT, wait=LOCK_WAIT)
+
+    def _count(self, field: str) -> None:
+        global _flush_task
+        _pending_stats[field] = _pending_stats.get(field, 0) + 1
+        if _flush_task is None or _flush_task.done():
+            _flush_task = asyncio.create_task(self._flush_stats())
+
+    async def _flush_stats(self) -> None:
+        while _pending_stats:
+            pending = dict(_pending_stats)
+            _pending_stats.clear()
+            try:
+                async with self._lock(STATS_LOCK_KEY):
+                    stats = await self.cache_dict.get.aio(STATS_KEY, {"hits": 0, "misses": 0})
+                    for field, count in pending.items():
+                        stats[field] = stats.get(field, 0) + count
+                    await self.cache_dict.put.aio(STATS_KEY, stats)
+            except Exception as e:
+                print(f"[ComponentCache] Failed to record stats {pending}: {e}")
+                return
+
+    def _in_background(self, coro: t.Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coro)
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+    async def get(self, prompt: str) -> t.Optional[tuple[str, str]]:
+        key = cache_key(prompt)
+        entry = await self.cache_dict.get.aio(f"entry_{key}")
+        now = time.time()
+        if entry is None or now - entry["created_at"] > self.ttl:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        self._in_background(self._touch(key, now))
+        print(f"[ComponentCache] Hit for prompt: {prompt[:80]}")
+        return entry["component"], entry["explanation"]
+
+    async def _touch(self, key: str, now: float) -> None:
+        """Refresh an entry's recency in the index, at most once per `ACCESS_RESOLUTION`."""
+        try:
+            index = await self.cache_dict.get.aio(INDEX_KEY, {})
+            if key not in index or now - index[key][1] <= ACCESS_RESOLUTION:
+                return
+            async with self._lock(INDEX_LOCK_KEY):
+                index = await self.cache_dict.get.aio(INDEX_KEY, {})
+                if key in index:
+                    index[key][1] = now
+                    await self.cache_dict.put.aio(INDEX_KEY, index)
+        except Exception as e:
+            print(f"[ComponentCache] Failed to refresh the recency of {key}: {e}")
+
+    async def put(self, prompt: str, component: str, explanation: str) -> None:
+        if not is_component_valid(component):
+            return
+        key = cache_key(prompt)
+        now = time.time()
+        size = len(component.encode()) + len(explanation.encode())
+        await self.cache_dict.put.aio(f"entry_{key}", {
+            "component": component,
+            "explanation": explanation,
+            "prompt": normalize_prompt(prompt),
+            "created_at": now,
+        })
+        async with self._lock(INDEX_LOCK_KEY):
+            index, signatures = await asyncio.gather(
+                self.cache_dict.get.aio(INDEX_KEY, {}), self.cache_dict.get.aio(SIGNATURES_KEY, {})
+            )
+            index[key] = [size, now, now]
+            evicted = self._evict(index, now)
+            signatures = {key: sig for key, sig in signatures.items() if key in index}
+            signatures[key] = signature(normalize_prompt(prompt))
+            await asyncio.gather(
+                self.cache_dict.put.aio(INDEX_KEY, index), self.cache_dict.put.aio(SIGNATURES_KEY, signatures)
+            )
+        # Out of the index, the evicted entries are unreachable; they can be deleted after the lock is released.
+        await asyncio.gather(*(self._discard(f"entry_{key}") for key in evicted))
+
+    async def _discard(self, key: str) -> None:
+        try:
+            await self.cache_dict.pop.aio(key)
+        except KeyError:
+            pass
+
+    async def nearest(
+        self, prompt: str, threshold: float = SIMILARITY_THRESHOLD
+    ) -> t.Optional[tuple[str, str, float]]:
+        """Find the cached component whose prompt is most similar to `prompt`.
+
+        Returns `(cached prompt, component, similarity)`, or None if no cached prompt clears `threshold`.
+        """
+        signatures = await self.cache_dict.get.aio(SIGNATURES_KEY, {})
+        match = PromptIndex(signatures).nearest(signature(normalize_prompt(prompt)), threshold)
+        if match is None:
+            return None
+        key, score = match
+        entry = await self.cache_dict.get.aio(f"entry_{key}")
+        if entry is None or time.time() - entry["created_at"] > self.ttl:
+            return None
+        self._count("similar_hits")
+        print(f"[ComponentCache] Similar prompt ({score:.2f}) for: {prompt[:80]}")
+        return entry["prompt"], entry["component"], score
+
+    def _evict(self, index: dict, now: float) -> list[str]:
+        """Drop expired entries, then least recently used ones, from the index until the cache fits its budget.
+
+        Returns the keys dropped; the caller deletes their entries.
+        """
+        expired = [key for key, (_, _, created_at) in index.items() if now - created_at > self.ttl]
+        total_bytes = sum(size for size, _, _ in index.values())
+        by_recency = sorted(
+            (key for key in index if key not in expired), key=lambda key: index[key][1]
+        )
+        evicted = list(expired)
+        total_bytes -= sum(index[key][0] for key in expired)
+        remaining = len(index) - len(expired)
+        for key in by_recency:
+            if remaining <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evicted.append(key)
+            total_bytes -= index[key][0]
+            remaining -= 1
+        for key in evicted:
+            del index[key]
+        if evicted:
+            print(f"[ComponentCache] Evicted {len(evicted)} entries, {remaining} left ({total_bytes} bytes)")
+        return evicted
+
+    async def stats(self) -> dict:
+        stats = await self.cache_dict.get.aio(STATS_KEY, {"hits": 0, "misses": 0})
+        index = await self.cache_dict.get.aio(INDEX_KEY, {})
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        return {
+            "hits": stats.get("hits", 0),
+            "misses": stats.get("misses", 0),
+            "similar_hits": stats.get("similar_hits", 0),
+            "hit_rate": round(stats.get("hits", 0) / lookups, 4) if lookups else 0.0,
+            "entries": len(index),
+            "bytes": sum(size for size, _, _ in index.values()),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
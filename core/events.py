@@ -0,0 +1,133 @@
+"""Server-push fan-out of catalogue and app status changes to connected clients."""
+
+import asyncio
+import json
+import typing as t
+
+from core.models import AppMetadata, AppStatus
+
+# Topic every gallery subscriber listens on; per-app subscribers use the app id as their topic.
+GALLERY_TOPIC = "gallery"
+# How often each controller container checks the shared catalogue version for writes made elsewhere.
+WATCH_INTERVAL = 1.0
+# Events buffered per subscriber before the oldest are dropped for a slow client.
+SUBSCRIBER_BUFFER = 100
+
+
+class Event(t.NamedTuple):
+    type: str
+    data: dict
+
+    def to_sse(self) -> str:
+        return f"event: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class EventBus:
+    """In-process pub/sub of events to the SSE streams open on this container."""
+
+    def __init__(self):
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        self._subscribers.setdefault(topic, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(topic)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[topic]
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def publish(self, topic: str, event: Event) -> None:
+        for queue in self._subscribers.get(topic, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+class CatalogueWatcher:
+    """Turns catalogue changes into events on an `EventBus`.
+
+    Every controller container runs one watcher, which re-reads the shared catalogue version at most
+    once per `WATCH_INTERVAL` (or immediately after a local write) and diffs the refreshed catalogue
+    against its last snapshot. Writes from other containers and from the cleanup job therefore reach
+    this container's subscribers through a single version read, however many clients are connected.
+    """
+
+    def __init__(self, app_directory, bus: EventBus):
+        self.app_directory = app_directory
+        self.bus = bus
+        self._snapshot = self._copy(app_directory.apps)
+        self._wake = asyncio.Event()
+        self._task: t.Optional[asyncio.Task] = None
+        app_directory.listeners.append(self._on_local_write)
+
+    @staticmethod
+    def _copy(apps: dict[str, AppMetadata]) -> dict[str, AppMetadata]:
+        # Handlers mutate cached metadata in place before saving it, so the snapshot keeps its own copies.
+        return {app_id: metadata.model_copy() for app_id, metadata in apps.items()}
+
+    def _on_local_write(self, change: str, app_id: str) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            # The directory is loaded on startup, after this watcher was constructed.
+            self._snapshot = self._copy(self.app_directory.apps)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=WATCH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self.bus.has_subscribers():
+                continue
+            try:
+                await self.app_directory.refresh(ttl=0)
+                # A failed load leaves no version; diffing against it would report phantom changes.
+                if self.app_directory.version is not None:
+                    self._publish_changes()
+            except Exception as e:
+                print(f"[CatalogueWatcher] Failed to publish catalogue changes: {e}")
+
+    def _publish_changes(self) -> None:
+        current = self._copy(self.app_directory.apps)
+        added = [app_id for app_id in current if app_id not in self._snapshot]
+        removed = [app_id for app_id in self._snapshot if app_id not in current]
+        updated = [
+            app_id for app_id, metadata in current.items()
+            if app_id in self._snapshot and metadata != self._snapshot[app_id]
+        ]
+
+        for app_id in removed:
+            self.bus.publish(app_id, Event("status", {"app_id": app_id, "status": AppStatus.TERMINATED.value}))
+        for app_id in added + updated:
+            metadata = current[app_id]
+            previous = self._snapshot.get(app_id)
+            if previous is None or previous.status != metadata.status:
+                self.bus.publish(app_id, Event("status", {"app_id": app_id, "status": metadata.status.value}))
+            if previous is None or previous.message_count != metadata.message_count:
+                self.bus.publish(app_id, Event("message", {"app_id": app_id, "message_count": metadata.message_count}))
+
+        if added or removed or updated:
+            self.bus.publish(GALLERY_TOPIC, Event("catalogue", {
+                "version": self.app_directory.version,
+                "added": added,
+                "updated": updated,
+                "removed": removed,
+            }))
+        self._snapshot = current
@@ -0,0 +1,102 @@
+"""Keeps follow-up prompts a bounded size by folding old conversation turns into a rolling summary."""
+
+import asyncio
+import typing as t
+
+import anthropic
+
+from core.llm import generate_response
+from core.models import AppData, Message, MessageType
+
+# Most recent messages sent verbatim with every follow-up edit.
+HISTORY_RECENT_MESSAGES = 8
+# Older messages are only folded into the summary once this many have piled up past the recent window,
+# so the summary (and the cached prompt prefix behind it) changes every few turns rather than every turn.
+HISTORY_COMPACT_BATCH = 8
+# Upper bound on the estimated tokens of conversation (summary plus recent messages) in one prompt.
+HISTORY_TOKEN_BUDGET = 4000
+SUMMARY_MAX_TOKENS = 512
+SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+
+
+class HistorySummary(t.NamedTuple):
+    summary: str
+    # `AppData.summarized_count` the summary was built on top of, and the count it brings it to.
+    base_count: int
+    summarized_count: int
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _format(message: Message) -> str:
+    return f"{message.type}: {message.content}"
+
+
+def prompt_history(data: AppData, budget: int = HISTORY_TOKEN_BUDGET) -> list[Message]:
+    """The conversation to send with a follow-up edit: the summary of older turns, then the recent ones.
+
+    Recent messages are dropped oldest first if they would take the conversation over `budget`; the
+    newest message (the request being made) is always kept.
+    """
+    summary = (
+        [Message(content=f"Summary of the earlier conversation: {data.history_summary}", type=MessageType.ASSISTANT)]
+        if data.history_summary else []
+    )
+    remaining = budget - sum(estimate_tokens(_format(message)) for message in summary)
+    unsummarized = data.message_history[data.summarized_count:]
+    recent: list[Message] = []
+    for message in reversed(unsummarized):
+        cost = estimate_tokens(_format(message))
+        if recent and cost > remaining:
+            break
+        recent.append(message)
+        remaining -= cost
+    return summary + recent[::-1]
+
+
+def needs_compaction(data: AppData, budget: int = HISTORY_TOKEN_BUDGET) -> bool:
+    unsummarized = data.message_history[data.summarized_count:]
+    if len(unsummarized) > HISTORY_RECENT_MESSAGES + HISTORY_COMPACT_BATCH:
+        return True
+    # A few very long messages can blow the budget before the batch fills up.
+    older = unsummarized[:-HISTORY_RECENT_MESSAGES]
+    return bool(older) and sum(estimate_tokens(_format(message)) for message in unsummarized) > budget
+
+
+async def summarize_history(client: anthropic.Anthropic, data: AppData) -> HistorySummary:
+    """Fold every message before the recent window into the existing summary."""
+    base_count = data.summarized_count
+    summarized_count = max(base_count, len(data.message_history) - HISTORY_RECENT_MESSAGES)
+    turns = "\n".join(_format(message) for message in data.message_history[base_count:summarized_count])
+    prompt = f"""
+    You are maintaining a running summary of a conversation in which a user asks an assistant to build and edit a React component.
+
+    Summary so far: {data.history_summary or "(none)"}
+
+    New messages:
+    {turns}
+
+    Rewrite the summary so it also covers the new messages. Keep every requirement, preference and design decision the user still expects the component to follow, and drop pleasantries.
+    Respond with the summary only, in a few short sentences or bullet points.
+    """
+    summary = await generate_response(client, prompt, model=SUMMARY_MODEL, max_tokens=SUMMARY_MAX_TOKENS, purpose="summary")
+    return HistorySummary(summary.strip(), base_count, summarized_count)
+
+
+def start_compaction(client: anthropic.Anthropic, data: AppData) -> t.Optional[asyncio.Task]:
+    """Start summarizing old turns in the background if they are due, returning the task (or None)."""
+    if not needs_compaction(data):
+        return None
+    return asyncio.create_task(summarize_history(client, data.model_copy(deep=True)))
+
+
+def apply_summary(data: AppData, result: HistorySummary) -> bool:
+    """Store a summary on `data`, unless another summary was stored since it was started."""
+    if data.summarized_count != result.base_count or result.summarized_count > len(data.message_history):
+        return False
+    data.history_summary = result.summary
+    data.summarized_count = result.summarized_count
+    return True
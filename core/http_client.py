@@ -0,0 +1,122 @@
+"""Process-wide HTTP client for controller → sandbox traffic."""
+
+import asyncio
+import typing as t
+
+import httpx
+
+# Every sandbox is reached through its own tunnel host, so the pool mostly holds one warm connection per
+# sandbox; the caps bound how many tunnels a single container keeps open at once.
+MAX_CONNECTIONS = 200
+MAX_KEEPALIVE_CONNECTIONS = 100
+# Requests in flight to any one sandbox; more wait their turn, so a burst of pings or a stuck sandbox
+# can't take up the whole pool.
+MAX_REQUESTS_PER_HOST = 10
+KEEPALIVE_EXPIRY = 60.0
+DEFAULT_TIMEOUT = httpx.Timeout(timeout=60.0, connect=10.0)
+
+_client: t.Optional[httpx.AsyncClient] = None
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """A response body that calls `release` once it is closed, i.e. when the request is really done."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: t.Callable[[], None]):
+        self._stream = stream
+        self._release: t.Optional[t.Callable[[], None]] = release
+
+    async def __aiter__(self) -> t.AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class PerHostLimitTransport(httpx.AsyncBaseTransport):
+    """Wraps a transport so at most `limit` requests per origin are in flight at once.
+
+    httpx's own limits are process-wide; this keeps one origin from holding all of them. Origins
+    with nothing in flight or waiting are forgotten, so tunnels of terminated sandboxes don't pile up.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limit: int):
+        self._transport = transport
+        self._limit = limit
+        # origin -> [semaphore, requests holding or waiting for it]
+        self._hosts: dict[tuple[str, str, t.Optional[int]], list] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        origin = (request.url.scheme, request.url.host, request.url.port)
+        host = self._hosts.setdefault(origin, [asyncio.Semaphore(self._limit), 0])
+        host[1] += 1
+        try:
+            await host[0].acquire()
+        except BaseException:
+            self._leave(origin, host, acquired=False)
+            raise
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._leave(origin, host, acquired=True)
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, lambda: self._leave(origin, host, acquired=True)),
+            extensions=response.extensions,
+        )
+
+    def _leave(self, origin: tuple, host: list, acquired: bool) -> None:
+        if acquired:
+            host[0].release()
+        host[1] -= 1
+        if host[1] == 0 and self._hosts.get(origin) is host:
+            del self._hosts[origin]
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it on first use (or after it was closed).
+
+    Reusing one client keeps TLS connections to each sandbox tunnel alive between edits and
+    heartbeats, and negotiates HTTP/2 with tunnels that support it so concurrent requests to the same
+    sandbox share a connection. At most `MAX_REQUESTS_PER_HOST` requests to one sandbox run at once.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        transport = httpx.AsyncHTTPTransport(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+        _client = httpx.AsyncClient(
+            transport=PerHostLimitTransport(transport, MAX_REQUESTS_PER_HOST),
+            timeout=DEFAULT_TIMEOUT,
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
@@ -0,0 +1,114 @@
+"""Create-app jobs: /api/create returns a job at once and the create function reports its progress on it."""
+
+import asyncio
+import time
+import typing as t
+import uuid
+from enum import Enum
+
+import modal
+
+from core.locks import DictLock
+
+# How long a client-supplied request key keeps mapping to the job it first created.
+REQUEST_KEY_TTL = 24 * 3600
+# Lease and wait of the lock serializing creates that share a request key; the section it guards is
+# two or three Dict calls.
+REQUEST_KEY_LOCK_TIMEOUT = 10
+REQUEST_KEY_LOCK_WAIT = 5
+# How often a job event stream re-reads its job.
+JOB_POLL_INTERVAL = 0.5
+
+
+class JobStatus(Enum):
+    CREATED = "created"   # Accepted; the create function hasn't picked it up yet.
+    RUNNING = "running"   # The create function is booting the sandbox and generating the component.
+    ACTIVE = "active"     # The app is created and serving its initial component; `app_id` is set.
+    FAILED = "failed"     # Creation failed; `error` says why.
+
+
+class CreateJobs:
+    """Create-app jobs in a Modal Dict, under `job_{id}`.
+
+    A job records its status, the pipeline phases it has been through (`phase` is the latest) and,
+    once active, the app id. Retried requests that send the same request key get the job the first
+    request created instead of starting another one.
+    """
+
+    def __init__(self, jobs_dict: modal.Dict):
+        self.jobs_dict = jobs_dict
+        # Phases of one create are reported from concurrent tasks; this keeps their writes from racing.
+        self._lock = asyncio.Lock()
+
+    async def create(
+        self, prompt: str, request_key: t.Optional[str] = None, trace_parent: t.Optional[str] = None
+    ) -> tuple[dict, bool]:
+        """Return `(job, created)`: a new job, or the existing one for `request_key` with `created` False.
+
+        Creates sharing a request key run one at a time, so concurrent retries can't both miss the
+        mapping and start a job each. Raises `LockTimeout` if another create with the key holds it too long.
+        """
+        if not request_key:
+            return await self._new_job(prompt, trace_parent), True
+
+        key = f"request_{request_key}"
+        async with DictLock(self.jobs_dict, f"lock_{key}", REQUEST_KEY_LOCK_TIMEOUT, REQUEST_KEY_LOCK_WAIT):
+            existing = await self.jobs_dict.get.aio(key)
+            if existing is not None and time.time() - existing["at"] < REQUEST_KEY_TTL:
+                job = await self.get(existing["job_id"])
+                # A retry after a failure starts over rather than returning the failed job.
+                if job is not None and job["status"] != JobStatus.FAILED.value:
+                    return job, False
+            # The job is written before the key points at it, so a reader of the key always finds it.
+            job = await self._new_job(prompt, trace_parent)
+            await self.jobs_dict.put.aio(key, {"job_id": job["job_id"], "at": time.time()})
+        return job, True
+
+    async def _new_job(self, prompt: str, trace_parent: t.Optional[str]) -> dict:
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": JobStatus.CREATED.value,
+            "phase": "queued",
+            "phases": [{"phase": "queued", "at": now}],
+            "app_id": None,
+            "error": None,
+            "prompt": prompt,
+            "trace_parent": trace_parent,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self.jobs_dict.put.aio(f"job_{job['job_id']}", job)
+        return job
+
+    async def get(self, job_id: str) -> t.Optional[dict]:
+        return await self.jobs_dict.get.aio(f"job_{job_id}")
+
+    async def update(self, job_id: str, phase: t.Optional[str] = None, **fields) -> None:
+        """Record a new phase and/or set fields on a job. Only the create function writes a running job."""
+        async with self._lock:
+            job = await self.get(job_id)
+            if job is None:
+                print(f"[CreateJobs.update] Job {job_id} not found")
+                return
+            now = time.time()
+            if phase is not None:
+                job["phase"] = phase
+                job["phases"].append({"phase": phase, "at": now})
+            for field, value in fields.items():
+                job[field] = value.value if isinstance(value, JobStatus) else value
+            job["updated_at"] = now
+            await self.jobs_dict.put.aio(f"job_{job_id}", job)
+
+    def progress(self, job_id: t.Optional[str]) -> t.Optional[t.Callable[[str], t.Awaitable[None]]]:
+        """Callback recording a phase on the job, for `SandboxApp.create`'s `on_progress`."""
+        if job_id is None:
+            return None
+
+        async def report(phase: str) -> None:
+            try:
+                await self.update(job_id, phase=phase)
+            except Exception as e:
+                print(f"[CreateJobs.progress] Failed to record phase {phase} of job {job_id}: {e}")
+
+        return report
@@ -1,21 +1,341 @@
 """LLM logic for the sandbox app."""
 
+import asyncio
+import contextvars
 import os
+import time
+import typing as t
+import uuid
 from dotenv import load_dotenv
 
 from anthropic import AsyncAnthropic
 
+from core.metrics import LATENCY_BUCKETS, TOKEN_BUCKETS, Histogram
+from core.tracing import add_span, span
+
 load_dotenv()
 
 def get_llm_client():
     return AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 
 
-async def generate_response(client, prompt, model="claude-sonnet-4-20250514", max_tokens=8192, temperature=0.5):
-    message = await client.messages.create(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=max_tokens,
-        temperature=temperature,
+def cached_block(text: str) -> dict:
+    """A text content block ending a prompt-cache breakpoint: everything up to it can be reused by later calls."""
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
+class PromptCacheStats:
+    """Running totals of how much prompt input was served from Anthropic's prompt cache in this process."""
+
+    def __init__(self):
+        self.calls = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.uncached_tokens = 0
+
+    def record(self, usage) -> None:
+        self.calls += 1
+        self.cache_read_tokens += getattr(usage, "cache_read_input_tokens", None) or 0
+        self.cache_write_tokens += getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.uncached_tokens += getattr(usage, "input_tokens", None) or 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of all input tokens that were read from the cache."""
+        total = self.cache_read_tokens + self.cache_write_tokens + self.uncached_tokens
+        return self.cache_read_tokens / total if total else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "uncached_tokens": self.uncached_tokens,
+            "hit_rate": round(self.hit_rate, 4),
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+# App the LLM calls made in the current task are attributed to; set by `SandboxApp` before its calls.
+llm_app_id: contextvars.ContextVar[t.Optional[str]] = contextvars.ContextVar("llm_app_id", default=None)
+
+# USD per million tokens: (input, output, cache write, cache read).
+MODEL_PRICING = {
+    "claude-sonnet-4-20250514": (3.0, 15.0, 3.75, 0.30),
+    "claude-3-5-haiku-20241022": (0.80, 4.0, 1.0, 0.08),
+}
+# Apps whose token usage is tracked per process; the least recently active are dropped beyond this.
+APP_USAGE_LIMIT = 1000
+# Shared snapshots older than this are from containers that have gone away.
+METRICS_RETENTION = 24 * 3600
+METRICS_SOURCE = os.getenv("MODAL_TASK_ID") or uuid.uuid4().hex
+
+
+def call_cost(model: str, usage) -> float:
+    input_price, output_price, write_price, read_price = MODEL_PRICING.get(model, (0.0, 0.0, 0.0, 0.0))
+    return (
+        (getattr(usage, "input_tokens", None) or 0) * input_price
+        + (getattr(usage, "output_tokens", None) or 0) * output_price
+        + (getattr(usage, "cache_creation_input_tokens", None) or 0) * write_price
+        + (getattr(usage, "cache_read_input_tokens", None) or 0) * read_price
+    ) / 1_000_000
+
+
+class CallStats:
+    """Aggregates of the LLM calls made for one (model, purpose) pair."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.ttft = Histogram(LATENCY_BUCKETS)
+        self.input_tokens = Histogram(TOKEN_BUCKETS)
+        self.output_tokens = Histogram(TOKEN_BUCKETS)
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.cost = 0.0
+        self.stop_reasons: dict[str, int] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_sec": self.latency.to_dict(),
+            "ttft_sec": self.ttft.to_dict(),
+            "input_tokens": self.input_tokens.to_dict(),
+            "output_tokens": self.output_tokens.to_dict(),
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cost_usd": round(self.cost, 6),
+            "stop_reasons": dict(self.stop_reasons),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CallStats":
+        stats = cls()
+        stats.calls = data["calls"]
+        stats.errors = data["errors"]
+        stats.latency = Histogram.from_dict(data["latency_sec"])
+        stats.ttft = Histogram.from_dict(data["ttft_sec"])
+        stats.input_tokens = Histogram.from_dict(data["input_tokens"])
+        stats.output_tokens = Histogram.from_dict(data["output_tokens"])
+        stats.cache_read_tokens = data["cache_read_tokens"]
+        stats.cache_write_tokens = data["cache_write_tokens"]
+        stats.cost = data["cost_usd"]
+        stats.stop_reasons = dict(data["stop_reasons"])
+        return stats
+
+    def merge(self, other: "CallStats") -> None:
+        self.calls += other.calls
+        self.errors += other.errors
+        self.latency.merge(other.latency)
+        self.ttft.merge(other.ttft)
+        self.input_tokens.merge(other.input_tokens)
+        self.output_tokens.merge(other.output_tokens)
+        self.cache_read_tokens += other.cache_read_tokens
+        self.cache_write_tokens += other.cache_write_tokens
+        self.cost += other.cost
+        for reason, count in other.stop_reasons.items():
+            self.stop_reasons[reason] = self.stop_reasons.get(reason, 0) + count
+
+
+class LLMMetrics:
+    """Per-process latency, token and cost aggregates of every LLM call, by model and purpose and by app."""
+
+    def __init__(self):
+        self.calls: dict[tuple[str, str], CallStats] = {}
+        # app id -> {"calls", "input_tokens", "output_tokens", "cost_usd"}, most recently active last.
+        self.apps: dict[str, dict] = {}
+
+    def record(
+        self,
+        model: str,
+        purpose: str,
+        latency: float,
+        usage=None,
+        ttft: t.Optional[float] = None,
+        stop_reason: t.Optional[str] = None,
+        error: bool = False,
+    ) -> None:
+        stats = self.calls.setdefault((model, purpose), CallStats())
+        stats.calls += 1
+        stats.latency.observe(latency)
+        if ttft is not None:
+            stats.ttft.observe(ttft)
+        if error:
+            stats.errors += 1
+            return
+        stats.stop_reasons[stop_reason or "unknown"] = stats.stop_reasons.get(stop_reason or "unknown", 0) + 1
+        if usage is None:
+            return
+        input_tokens = (
+            (getattr(usage, "input_tokens", None) or 0)
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            + (getattr(usage, "cache_read_input_tokens", None) or 0)
+        )
+        output_tokens = getattr(usage, "output_tokens", None) or 0
+        cost = call_cost(model, usage)
+        stats.input_tokens.observe(input_tokens)
+        stats.output_tokens.observe(output_tokens)
+        stats.cache_read_tokens += getattr(usage, "cache_read_input_tokens", None) or 0
+        stats.cache_write_tokens += getattr(usage, "cache_creation_input_tokens", None) or 0
+        stats.cost += cost
+
+        app_id = llm_app_id.get()
+        if app_id is not None:
+            app_usage = self.apps.pop(app_id, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0})
+            app_usage["calls"] += 1
+            app_usage["input_tokens"] += input_tokens
+            app_usage["output_tokens"] += output_tokens
+            app_usage["cost_usd"] += cost
+            self.apps[app_id] = app_usage
+            while len(self.apps) > APP_USAGE_LIMIT:
+                del self.apps[next(iter(self.apps))]
+
+    def to_dict(self, top_apps: int = 20) -> dict:
+        by_cost = sorted(self.apps.items(), key=lambda item: item[1]["cost_usd"], reverse=True)
+        return {
+            "calls": [
+                {"model": model, "purpose": purpose, **stats.to_dict()}
+                for (model, purpose), stats in sorted(self.calls.items())
+            ],
+            "total_cost_usd": round(sum(stats.cost for stats in self.calls.values()), 6),
+            "top_apps": [
+                {"app_id": app_id, **usage, "cost_usd": round(usage["cost_usd"], 6)}
+                for app_id, usage in by_cost[:top_apps]
+            ],
+        }
+
+    def snapshot(self) -> dict:
+        """Everything needed to rebuild these metrics in another process (see `merge_snapshot`)."""
+        return {
+            "calls": [[model, purpose, stats.to_dict()] for (model, purpose), stats in self.calls.items()],
+            "apps": self.apps,
+        }
+
+    def merge_snapshot(self, snapshot: dict) -> None:
+        for model, purpose, data in snapshot["calls"]:
+            self.calls.setdefault((model, purpose), CallStats()).merge(CallStats.from_dict(data))
+        for app_id, usage in snapshot["apps"].items():
+            merged = self.apps.setdefault(app_id, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0})
+            for field, value in usage.items():
+                merged[field] += value
+
+
+llm_metrics = LLMMetrics()
+
+
+async def publish_llm_metrics(metrics_dict) -> None:
+    """Save this process's metrics to a shared Modal Dict, under a key of its own."""
+    try:
+        await metrics_dict.put.aio(f"source_{METRICS_SOURCE}", {"updated_at": time.time(), "metrics": llm_metrics.snapshot()})
+    except Exception as e:
+        print(f"[llm] Failed to publish metrics: {e}")
+
+
+async def collect_llm_metrics(metrics_dict) -> LLMMetrics:
+    """Merge the metrics every live process has published, dropping snapshots of containers long gone."""
+    merged = LLMMetrics()
+    async for key in metrics_dict.keys.aio():
+        entry = await metrics_dict.get.aio(key)
+        if entry is None:
+            continue
+        if time.time() - entry["updated_at"] > METRICS_RETENTION:
+            try:
+                await metrics_dict.pop.aio(key)
+            except KeyError:
+                pass
+            continue
+        merged.merge_snapshot(entry["metrics"])
+    return merged
+
+
+def _record_usage(model: str, usage) -> None:
+    prompt_cache_stats.record(usage)
+    print(
+        f"[llm] {model}: cache read {getattr(usage, 'cache_read_input_tokens', 0) or 0}, "
+        f"cache write {getattr(usage, 'cache_creation_input_tokens', 0) or 0}, "
+        f"uncached {usage.input_tokens}, output {usage.output_tokens} "
+        f"(process hit rate {prompt_cache_stats.hit_rate:.1%})"
     )
-    return message.content[0].text
\ No newline at end of file
+
+
+def _request(prompt, model, max_tokens, temperature, system) -> dict:
+    request = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    if system is not None:
+        request["system"] = system
+    return request
+
+
+async def generate_response(
+    client, prompt, model="claude-sonnet-4-20250514", max_tokens=8192, temperature=0.5, system=None, purpose="other"
+):
+    """Generate a completion. `prompt` and `system` may be strings or lists of content blocks (see `cached_block`).
+
+    `purpose` labels the call in `llm_metrics` and names its span (`llm.{purpose}`) in the current trace.
+    """
+    started = time.monotonic()
+    try:
+        with span(f"llm.{purpose}", model=model) as attributes:
+            message = await client.messages.create(**_request(prompt, model, max_tokens, temperature, system))
+            attributes["output_tokens"] = message.usage.output_tokens
+    except Exception:
+        llm_metrics.record(model, purpose, time.monotonic() - started, error=True)
+        raise
+    llm_metrics.record(model, purpose, time.monotonic() - started, message.usage, stop_reason=message.stop_reason)
+    _record_usage(model, message.usage)
+    return message.content[0].text
+
+
+async def stream_response(
+    client, prompt, model="claude-sonnet-4-20250514", max_tokens=8192, temperature=0.5, system=None, purpose="other"
+) -> t.AsyncIterator[str]:
+    """Same as `generate_response`, but yields the text deltas as the model produces them.
+
+    The call is recorded however the stream ends, including when the consumer stops early (e.g. the
+    browser disconnected); such a call is recorded with the `abandoned` stop reason and whatever usage
+    had been reported by then. Its span is added when the stream ends, as the stream's lifetime
+    isn't a block of the caller's.
+    """
+    started = time.monotonic()
+    ttft = None
+    stream = None
+    final = None
+    failure: t.Optional[BaseException] = None
+    try:
+        async with client.messages.stream(**_request(prompt, model, max_tokens, temperature, system)) as stream:
+            async for text in stream.text_stream:
+                if ttft is None:
+                    ttft = time.monotonic() - started
+                yield text
+            final = await stream.get_final_message()
+    except BaseException as e:
+        failure = e
+        raise
+    finally:
+        latency = time.monotonic() - started
+        attributes: dict = {"model": model}
+        if ttft is not None:
+            attributes["ttft_sec"] = round(ttft, 3)
+        if final is not None:
+            llm_metrics.record(model, purpose, latency, final.usage, ttft=ttft, stop_reason=final.stop_reason)
+            _record_usage(model, final.usage)
+            attributes["output_tokens"] = final.usage.output_tokens
+        elif isinstance(failure, (GeneratorExit, asyncio.CancelledError)):
+            snapshot = getattr(stream, "current_message_snapshot", None) if stream is not None else None
+            usage = getattr(snapshot, "usage", None)
+            llm_metrics.record(model, purpose, latency, usage, ttft=ttft, stop_reason="abandoned")
+            if usage is not None:
+                _record_usage(model, usage)
+            attributes["abandoned"] = True
+        else:
+            llm_metrics.record(model, purpose, latency, ttft=ttft, error=True)
+            attributes["error"] = f"{type(failure).__name__}: {failure}"
+        add_span(f"llm.{purpose}", latency, **attributes)
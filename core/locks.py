@@ -0,0 +1,63 @@
+"""Leased locks kept in a Modal Dict, for read-modify-write sequences shared across containers."""
+
+import asyncio
+import time
+import typing as t
+import uuid
+
+import modal
+
+
+class LockTimeout(Exception):
+    """Raised when a lock couldn't be taken within its wait."""
+
+
+class DictLock:
+    """A lock under `key` in a Modal Dict, taken with an atomic put-if-absent.
+
+    The holder's entry records when it was taken; a lock held longer than `timeout` is presumed
+    abandoned (e.g. its container died) and taken over. Waiters poll, so a lock should only
+    guard short sections or be contended by few waiters.
+    """
+
+    def __init__(self, store: modal.Dict, key: str, timeout: float, wait: float, poll_interval: float = 0.05):
+        self.store = store
+        self.key = key
+        self.timeout = timeout
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self._token: t.Optional[str] = None
+
+    async def acquire(self) -> None:
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait
+        while not await self.store.put.aio(self.key, {"token": token, "at": time.time()}, skip_if_exists=True):
+            held = await self.store.get.aio(self.key)
+            if held is not None and time.time() - held["at"] > self.timeout:
+                print(f"[DictLock] Taking over {self.key}, held since {held['at']}")
+                await self._unlock(held["token"])
+                continue
+            if time.monotonic() > deadline:
+                raise LockTimeout(f"{self.key} is busy")
+            await asyncio.sleep(self.poll_interval)
+        self._token = token
+
+    async def release(self) -> None:
+        if self._token is not None:
+            await self._unlock(self._token)
+            self._token = None
+
+    async def _unlock(self, token: str) -> None:
+        held = await self.store.get.aio(self.key)
+        if held is not None and held["token"] == token:
+            try:
+                await self.store.pop.aio(self.key)
+            except KeyError:
+                pass
+
+    async def __aenter__(self) -> "DictLock":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.release()
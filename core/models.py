@@ -47,8 +47,10 @@ class AppMetadata(BaseModel):
     updated_at: datetime
     status: AppStatus
     sandbox_user_tunnel_url: str
+    sandbox_tunnel_url: str = ""
     title: str = ""
     is_featured: bool = False 
+    message_count: int = 0
     
     def model_dump(self, **kwargs):
         """Override model_dump to handle AppStatus enum serialization"""
@@ -68,6 +70,11 @@ class AppData(BaseModel):
     sandbox_tunnel_url: str
     sandbox_user_tunnel_url: str
     sandbox_object_id: str
+    # Rolling summary of `message_history[:summarized_count]`, sent in place of those messages (see core/history.py).
+    history_summary: str = ""
+    summarized_count: int = 0
+    # Bumped by every save; a save only goes through if the stored revision is still the one it read.
+    revision: int = 0
     
     def model_dump(self, **kwargs):
         data = super().model_dump(**kwargs)
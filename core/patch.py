@@ -0,0 +1,62 @@
+"""Search/replace patches the model returns for follow-up edits, and their application to a component."""
+
+import re
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+
+_HUNK_PATTERN = re.compile(
+    rf"^{re.escape(SEARCH_MARKER)}[ \t]*\n(.*?)^{DIVIDER}[ \t]*\n(.*?)^{re.escape(REPLACE_MARKER)}[ \t]*$",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+class PatchError(Exception):
+    """Raised when a patch can't be parsed or applied cleanly."""
+
+
+def parse_hunks(patch: str) -> list[tuple[str, str]]:
+    """Split a patch into `(search, replace)` pairs, in order."""
+    return [(search, replace) for search, replace in _HUNK_PATTERN.findall(patch)]
+
+
+def is_component_valid(component: str) -> bool:
+    """Cheap structural check of a component before it is sent to the sandbox."""
+    return (
+        "export default" in component
+        and "LLMComponent" in component
+        and component.count("{") == component.count("}")
+    )
+
+
+def apply_patch(source: str, patch: str) -> str:
+    """Apply every hunk of `patch` to `source` and return the validated result.
+
+    Each search block must match the source exactly once. A patch with no hunks is accepted only if it
+    is itself a complete, valid component (the model may answer a sweeping change with a rewrite).
+    Search blocks always end with a newline, so a source without a trailing one (stored components
+    are stripped) is matched as if it had one, and the result is stripped of it again.
+    """
+    hunks = parse_hunks(patch)
+    if not hunks:
+        component = patch.strip()
+        if SEARCH_MARKER not in component and is_component_valid(component):
+            return component
+        raise PatchError("Response contains no search/replace hunks")
+
+    terminated = source.endswith("\n")
+    result = source if terminated else source + "\n"
+    for index, (search, replace) in enumerate(hunks):
+        if not search.strip():
+            raise PatchError(f"Hunk {index + 1} has an empty search block")
+        occurrences = result.count(search)
+        if occurrences != 1:
+            raise PatchError(f"Hunk {index + 1} search block matches {occurrences} times")
+        result = result.replace(search, replace, 1)
+    if not terminated and result.endswith("\n"):
+        result = result[:-1]
+
+    if not is_component_valid(result):
+        raise PatchError("Patched component failed validation")
+    return result
@@ -0,0 +1,152 @@
+"""Pool of booted, tunnelled sandboxes kept warm so app creation doesn't wait for a cold boot."""
+
+import asyncio
+import queue
+import time
+import typing as t
+
+import httpx
+import modal
+
+from core.sandbox import SandboxApp
+
+POOL_TARGET_SIZE = 4     # Refills top the pool back up to this many warm sandboxes.
+POOL_MIN_SIZE = 2        # Claiming below this many warm sandboxes triggers a background refill.
+POOL_MAX_SIZE = 16       # Never keep more than this many warm sandboxes, whatever the target says.
+WARM_SANDBOX_MAX_AGE = 30 * 60  # Warm sandboxes older than this are terminated instead of handed out.
+
+
+class SandboxPool:
+    """Warm sandboxes shared across containers through a Modal Queue.
+
+    Each queue entry describes one sandbox that has booted, opened its tunnels and answered a
+    heartbeat. `claim()` pops the oldest usable one; `refill()` expires stale entries and boots new
+    sandboxes until the pool is back at its target size.
+    """
+
+    def __init__(
+        self,
+        pool_queue: modal.Queue,
+        app: modal.App,
+        image: modal.Image,
+        target_size: int = POOL_TARGET_SIZE,
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        max_age: float = WARM_SANDBOX_MAX_AGE,
+    ):
+        if not 0 <= min_size <= target_size <= max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= target_size <= max_size")
+        self.queue = pool_queue
+        self.app = app
+        self.image = image
+        self.target_size = target_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+
+    async def size(self) -> int:
+        return await self.queue.len.aio()
+
+    async def needs_refill(self) -> bool:
+        return await self.size() < self.min_size
+
+    async def _pop(self) -> t.Optional[dict]:
+        try:
+            return await self.queue.get.aio(block=False)
+        except queue.Empty:
+            return None
+
+    def _is_stale(self, entry: dict) -> bool:
+        return time.time() - entry["created_at"] > self.max_age
+
+    async def claim(self, client: httpx.AsyncClient) -> t.Optional[tuple[str, str, str]]:
+        """Take a live warm sandbox out of the pool, or return None if none is available.
+
+        Returns `(sandbox_tunnel_url, sandbox_user_tunnel_url, sandbox_object_id)`, like the first three
+        values returned by `run_sandbox_server_with_tunnel`.
+        """
+        while True:
+            entry = await self._pop()
+            if entry is None:
+                print("[SandboxPool] No warm sandbox available")
+                return None
+            if self._is_stale(entry):
+                print(f"[SandboxPool] Discarding stale warm sandbox {entry['sandbox_object_id']}")
+                await self._terminate(entry)
+                continue
+            if not await SandboxApp.heartbeat(client, entry["sandbox_object_id"], entry["sandbox_tunnel_url"]):
+                print(f"[SandboxPool] Discarding unresponsive warm sandbox {entry['sandbox_object_id']}")
+                await self._terminate(entry)
+                continue
+            print(f"[SandboxPool] Claimed warm sandbox {entry['sandbox_object_id']}")
+            return entry["sandbox_tunnel_url"], entry["sandbox_user_tunnel_url"], entry["sandbox_object_id"]
+
+    async def expire(self) -> int:
+        """Terminate warm sandboxes older than `max_age`, keeping the rest in their original order."""
+        fresh = []
+        expired = 0
+        for _ in range(await self.size()):
+            entry = await self._pop()
+            if entry is None:
+                break
+            if self._is_stale(entry):
+                await self._terminate(entry)
+                expired += 1
+            else:
+                fresh.append(entry)
+        if fresh:
+            await self.queue.put_many.aio(fresh)
+        return expired
+
+    async def refill(self, client: httpx.AsyncClient) -> dict:
+        """Expire stale sandboxes, then boot enough new ones to reach the target size."""
+        started = time.monotonic()
+        expired = await self.expire()
+        size = await self.size()
+        missing = max(0, min(self.target_size, self.max_size) - size)
+        results = await asyncio.gather(
+            *(self._boot(client) for _ in range(missing)), return_exceptions=True
+        )
+        booted = [entry for entry in results if isinstance(entry, dict)]
+        for error in results:
+            if isinstance(error, Exception):
+                print(f"[SandboxPool] Failed to boot warm sandbox: {error}")
+        if booted:
+            await self.queue.put_many.aio(booted)
+        summary = {
+            "expired": expired,
+            "booted": len(booted),
+            "failed": missing - len(booted),
+            "size": size + len(booted),
+            "duration_sec": round(time.monotonic() - started, 3),
+        }
+        print(f"[SandboxPool.refill] {summary}")
+        return summary
+
+    async def _boot(self, client: httpx.AsyncClient, max_attempts: int = 30, delay: float = 1.0) -> dict:
+        from sandbox.start_sandbox import run_sandbox_server_with_tunnel
+
+        sandbox_tunnel_url, sandbox_user_tunnel_url, sandbox_object_id, _ = await run_sandbox_server_with_tunnel(
+            app=self.app, image=self.image
+        )
+        entry = {
+            "sandbox_tunnel_url": sandbox_tunnel_url,
+            "sandbox_user_tunnel_url": sandbox_user_tunnel_url,
+            "sandbox_object_id": sandbox_object_id,
+            "created_at": time.time(),
+        }
+        # After the ready signal the first heartbeat normally succeeds; polling only covers a missed signal.
+        for attempt in range(max_attempts):
+            if await SandboxApp.heartbeat(client, sandbox_object_id, sandbox_tunnel_url):
+                return entry
+            if attempt < max_attempts - 1:
+                await asyncio.sleep(delay)
+        await self._terminate(entry)
+        raise RuntimeError(f"Warm sandbox {sandbox_object_id} never answered its heartbeat")
+
+    async def _terminate(self, entry: dict) -> None:
+        try:
+            sandbox = await modal.Sandbox.from_id.aio(entry["sandbox_object_id"])
+            await sandbox.terminate.aio()
+        except Exception as e:
+            print(f"[SandboxPool] Failed to terminate sandbox {entry['sandbox_object_id']}: {e}")
@@ -1,31 +1,59 @@
 """Prompting texts used to build the sandbox app."""
 
-from core.llm import generate_response
+import time
+import typing as t
+
+from core.history import estimate_tokens
+from core.llm import cached_block, generate_response, stream_response
 import anthropic
-from core.models import Message
+from core.models import Message, MessageType
+from core.patch import DIVIDER, REPLACE_MARKER, SEARCH_MARKER, PatchError, apply_patch, is_component_valid, parse_hunks
+from core.routing import SIMPLE, EditRoute, route_edit, routing_stats
+
+# Model used to generate components, and a version of the prompt templates below; bump it whenever a
+# template changes so components cached from the old prompt are not served any more.
+COMPONENT_MODEL = "claude-sonnet-4-20250514"
+PROMPT_TEMPLATE_VERSION = 2
+COMPONENT_MAX_TOKENS = 8192
+# Model simple follow-up edits are routed to (see `core.routing`); it is only asked for patches. Its
+# output budget covers a rewrite of the whole component (the patch prompt allows one) with some
+# headroom, within the model's own limit; a response cut off anyway fails to apply and is escalated.
+FAST_COMPONENT_MODEL = "claude-3-5-haiku-20241022"
+FAST_COMPONENT_MIN_TOKENS = 2048
+FAST_COMPONENT_TOKEN_HEADROOM = 512
+FAST_COMPONENT_MAX_TOKENS = 8192
+
+# Instructions shared by every component-generating call. Sent as a cached system block so repeated
+# calls don't re-process it as fresh input.
+COMPONENT_INSTRUCTIONS = """
+You should use Tailwind CSS for styling. Please make sure to export the component as default.
+This is incredibly important for my job, please be careful and don't make any mistakes.
+Make sure you import all necessary dependencies.
+Define any helper components and functions before the default export, so the exported component comes last.
+
+RESPONSE FORMAT:
+import React from 'react';
+export default function LLMComponent() {
+    return (
+        <div className="bg-red-500">
+            <h1>LLM Component</h1>
+        </div>
+    )
+}
+
+DO NOT include any other text in your response. Only the React component. MAKE SURE TO NAME THE COMPONENT "LLMComponent". DO NOT WRAP THE CODE IN A CODE BLOCK.
+"""
+
 
 async def _generate_init_edit(client: anthropic.Anthropic, message: str) -> str:
     prompt = f"""
     You are given the following prompt and your job is to generate a React component that is a good example of the prompt.
-    You should use Tailwind CSS for styling. Please make sure to export the component as default.
-    This is incredibly important for my job, please be careful and don't make any mistakes.
-    Make sure you import all necessary dependencies.
 
     Prompt: {message}
-
-    RESPONSE FORMAT:
-    import React from 'react';
-    export default function LLMComponent() {{
-        return (
-            <div className="bg-red-500">
-                <h1>LLM Component</h1>
-            </div>
-        )
-    }}
-
-    DO NOT include any other text in your response. Only the React component. MAKE SURE TO NAME THE COMPONENT "LLMComponent". DO NOT WRAP THE CODE IN A CODE BLOCK.
     """
-    response = await generate_response(client, prompt)
+    response = await generate_response(
+        client, prompt, model=COMPONENT_MODEL, system=[cached_block(COMPONENT_INSTRUCTIONS)], purpose="init"
+    )
     return response
 
 async def _explain_init_edit(
@@ -49,6 +77,7 @@ async def _explain_init_edit(
         prompt,
         model="claude-3-5-haiku-20241022",
         max_tokens=64,
+        purpose="explain_init",
     )
     return explanation
 
@@ -57,39 +86,236 @@ async def generate_and_explain_init_edit(client: anthropic.Anthropic, message: s
     explanation = await _explain_init_edit(message, edit, client)
     return edit, explanation
 
-async def _generate_followup_edit(client: anthropic.Anthropic, message: str, original_html: str, message_history: list[Message]) -> str:
-    message_history = '\n'.join([f"{msg.type}: {msg.content}" for msg in message_history])
+# Final instruction of a patch-mode follow-up. It goes in the last, uncached block so patch requests and
+# full-regeneration fallbacks share the cached system/history/component prefix.
+PATCH_REQUEST = f"""
+    Do not rewrite the whole component. Respond ONLY with one or more search/replace hunks against the existing component, in this exact format:
 
-    prompt = f"""
-    You should use Tailwind CSS for styling. Please make sure to export the component as default.
-    This is incredibly important for my job, please be careful and don't make any mistakes.
-    Make sure you import all necessary dependencies.
+    {SEARCH_MARKER}
+    exact lines copied from the existing component
+    {DIVIDER}
+    the lines that replace them
+    {REPLACE_MARKER}
 
-    The existing React component you are working with is this.
-    {original_html}
+    Each search block must match the existing component exactly, character for character, and only once; include enough surrounding lines to make it unique.
+    Hunks are applied in order. Do not include any other text. Only if the change rewrites most of the component, respond with the full component instead.
+    """
 
-    You are asked to make the following changes to the React component:
-    {message}
 
-    Here is the history of messages between the user and the assistant:
-    {message_history}
+def _followup_edit_prompt(
+    message: str, original_html: str, message_history: list[Message], request: t.Optional[str] = None
+) -> list[dict]:
+    """Build the follow-up request as content blocks ordered from most to least stable.
 
+    Each history message is its own block with a cache breakpoint after the last one, so the next
+    edit (whose history only has new messages appended) reuses the cached prefix. The current component
+    gets its own breakpoint, so retries against the same component hit the cache too. `request`
+    replaces the default "generate a React component" instruction at the end.
+    """
+    blocks: list[dict] = [{"type": "text", "text": "Here is the history of messages between the user and the assistant:"}]
+    blocks += [{"type": "text", "text": f"{msg.type}: {msg.content}"} for msg in message_history]
+    blocks[-1] = cached_block(blocks[-1]["text"])
+    blocks.append(cached_block(f"The existing React component you are working with is this.\n{original_html}"))
+    blocks.append({"type": "text", "text": f"""
+    You are asked to make the following changes to the React component:
+    {message}
+    """ + (request or f"""
     You are asked to generate a React component that is a good example of the prompt.
     Prompt: {message}
+    """)})
+    return blocks
+
+
+async def generate_seeded_init_edit(
+    client: anthropic.Anthropic, message: str, seed_prompt: str, seed_component: str
+) -> tuple[str, str]:
+    """Adapt the component generated for a similar prompt, instead of generating one from scratch.
+
+    The seed is patched like a follow-up edit; if the patch doesn't apply, the component is generated
+    from scratch after all.
+    """
+    history = [Message(content=seed_prompt, type=MessageType.USER)]
+    change = f"Adapt the component so it is a good example of this prompt instead: {message}"
+    prompt = _followup_edit_prompt(change, seed_component, history, request=PATCH_REQUEST)
+    patch = await generate_response(
+        client, prompt, model=COMPONENT_MODEL, system=[cached_block(COMPONENT_INSTRUCTIONS)], purpose="seed"
+    )
+    try:
+        edit = apply_patch(seed_component, patch)
+        print(f"Seeded initial edit from a similar prompt with {len(parse_hunks(patch))} hunks")
+    except PatchError as e:
+        print(f"Seed patch could not be applied ({e}), generating the component from scratch")
+        edit = await _generate_init_edit(client, message)
+    explanation = await _explain_init_edit(message, edit, client)
+    return edit, explanation
+
+
+class FollowupAttempt(t.NamedTuple):
+    model: str
+    max_tokens: int
+    # Ask for search/replace hunks; otherwise, for the full component.
+    patch: bool
+
+
+def followup_attempts(route: EditRoute, original_html: str) -> list[FollowupAttempt]:
+    """The calls a routed follow-up edit makes, in order, each only if the previous one's output doesn't apply.
 
-    RESPONSE FORMAT:
-    import React from 'react';
-    export default function LLMComponent() {{
-        return (
-            <div className="bg-red-500">
-                <h1>LLM Component</h1>
-            </div>
+    Every edit ends with the full model's patch and then its full component; a simple edit first tries
+    a patch from the fast model.
+    """
+    attempts = [
+        FollowupAttempt(COMPONENT_MODEL, COMPONENT_MAX_TOKENS, patch=True),
+        FollowupAttempt(COMPONENT_MODEL, COMPONENT_MAX_TOKENS, patch=False),
+    ]
+    if route.tier == SIMPLE:
+        max_tokens = min(
+            FAST_COMPONENT_MAX_TOKENS,
+            max(FAST_COMPONENT_MIN_TOKENS, estimate_tokens(original_html) + FAST_COMPONENT_TOKEN_HEADROOM),
         )
-    }}
+        attempts.insert(0, FollowupAttempt(FAST_COMPONENT_MODEL, max_tokens, patch=True))
+    return attempts
+
+
+async def _generate_followup_edit(
+    client: anthropic.Anthropic,
+    message: str,
+    original_html: str,
+    message_history: list[Message],
+    model: str = COMPONENT_MODEL,
+    max_tokens: int = COMPONENT_MAX_TOKENS,
+) -> str:
+    prompt = _followup_edit_prompt(message, original_html, message_history)
+    return await generate_response(
+        client,
+        prompt,
+        model=model,
+        max_tokens=max_tokens,
+        system=[cached_block(COMPONENT_INSTRUCTIONS)],
+        purpose="followup",
+    )
+
+
+async def _generate_followup_patch(
+    client: anthropic.Anthropic,
+    message: str,
+    original_html: str,
+    message_history: list[Message],
+    model: str = COMPONENT_MODEL,
+    max_tokens: int = COMPONENT_MAX_TOKENS,
+) -> str:
+    prompt = _followup_edit_prompt(message, original_html, message_history, request=PATCH_REQUEST)
+    return await generate_response(
+        client,
+        prompt,
+        model=model,
+        max_tokens=max_tokens,
+        system=[cached_block(COMPONENT_INSTRUCTIONS)],
+        purpose="followup_patch",
+    )
+
+
+async def generate_followup_edit(client: anthropic.Anthropic, message: str, original_html: str, message_history: list[Message]) -> str:
+    """Produce the edited component by asking for a patch, regenerating it in full only if the patch doesn't apply.
+
+    Edits routed as simple ask the fast model for the patch first, and escalate to the full model if
+    it doesn't apply (see `followup_attempts`).
+    """
+    started = time.monotonic()
+    route = await route_edit(client, message, original_html)
+    attempts = followup_attempts(route, original_html)
+    for attempt in attempts:
+        if not attempt.patch:
+            edit = await _generate_followup_edit(
+                client, message, original_html, message_history, attempt.model, attempt.max_tokens
+            )
+            break
+        patch = await _generate_followup_patch(
+            client, message, original_html, message_history, attempt.model, attempt.max_tokens
+        )
+        try:
+            edit = apply_patch(original_html, patch)
+            print(f"Applied {attempt.model} patch with {len(parse_hunks(patch))} hunks ({len(patch)} chars instead of {len(edit)})")
+            break
+        except PatchError as e:
+            print(f"{attempt.model} patch could not be applied ({e}), trying the next model or a full regeneration")
+    routing_stats.record(
+        route,
+        attempt.model,
+        time.monotonic() - started,
+        escalated=attempt.model != attempts[0].model,
+        failed=not is_component_valid(edit),
+    )
+    return edit
+
+
+async def _stream_followup_edit(
+    client: anthropic.Anthropic,
+    message: str,
+    original_html: str,
+    message_history: list[Message],
+    model: str = COMPONENT_MODEL,
+    max_tokens: int = COMPONENT_MAX_TOKENS,
+) -> t.AsyncIterator[str]:
+    prompt = _followup_edit_prompt(message, original_html, message_history)
+    async for text in stream_response(
+        client,
+        prompt,
+        model=model,
+        max_tokens=max_tokens,
+        system=[cached_block(COMPONENT_INSTRUCTIONS)],
+        purpose="followup_stream",
+    ):
+        yield text
+
+
+async def _stream_followup_patch(
+    client: anthropic.Anthropic,
+    message: str,
+    original_html: str,
+    message_history: list[Message],
+    model: str = COMPONENT_MODEL,
+    max_tokens: int = COMPONENT_MAX_TOKENS,
+) -> t.AsyncIterator[str]:
+    prompt = _followup_edit_prompt(message, original_html, message_history, request=PATCH_REQUEST)
+    async for text in stream_response(
+        client,
+        prompt,
+        model=model,
+        max_tokens=max_tokens,
+        system=[cached_block(COMPONENT_INSTRUCTIONS)],
+        purpose="followup_patch_stream",
+    ):
+        yield text
+
+
+def find_component_end(text: str) -> t.Optional[int]:
+    """Index just past the brace closing the default-exported component, once it has streamed in.
 
-    DO NOT include any other text in your response. Only the React component. MAKE SURE TO NAME THE COMPONENT "LLMComponent". DO NOT WRAP THE CODE IN A CODE BLOCK.
+    Only braces are counted (string contents are not parsed), so a `}` inside a string can end the
+    component early; callers only act on it while nothing has streamed in after the end, and still
+    re-check the complete response when the stream ends.
     """
-    return await generate_response(client, prompt)
+    start = text.find("export default")
+    if start == -1:
+        return None
+    depth = 0
+    parens = 0
+    opened = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if depth == 0 and char in "()":
+            # Braces in the signature (destructured props) are not the component body.
+            parens += 1 if char == "(" else -1
+        elif depth == 0 and parens > 0:
+            continue
+        elif char == "{":
+            depth += 1
+            opened = True
+        elif char == "}":
+            depth -= 1
+            if opened and depth == 0:
+                return i + 1
+    return None
 
 
 async def _explain_followup_edit(client: anthropic.Anthropic, message: str, original_html: str, new_html: str) -> str:
@@ -114,6 +340,7 @@ async def _explain_followup_edit(client: anthropic.Anthropic, message: str, orig
         prompt,
         model="claude-3-5-haiku-20241022",
         max_tokens=64,
+        purpose="explain_followup",
     )
     return explanation
     
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""Every component an app has had, stored once per distinct content and delta-compressed, for undo and rollback.
+
+Per app, the Dict holds:
+- `app_{id}:revisions`: the index, `{"entries": [...], "blobs": {hash: {...}}}`. Entries are the
+  app's timeline of components, oldest first; a rollback adds an entry pointing at an earlier hash.
+- `app_{id}:component@{hash}`: one blob per distinct component, zstd-compressed with the component
+  it was saved after as a raw-content dictionary, so a small edit costs roughly the size of its
+  change. Every `MAX_DELTA_CHAIN` deltas a blob is stored whole, bounding the blobs a read needs;
+  those are fetched together, so any revision loads in one round of Dict reads.
+"""
+
+import asyncio
+import difflib
+import hashlib
+import time
+import typing as t
+
+import modal
+import zstandard
+
+from core import storage
+
+ZSTD_LEVEL = 9
+# Deltas stacked on top of a whole blob before the next blob is stored whole.
+MAX_DELTA_CHAIN = 16
+# Timeline entries kept per app; blobs no kept entry needs are deleted.
+REVISION_HISTORY_LIMIT = 100
+NOTE_MAX_LENGTH = 200
+
+
+def content_hash(component: str) -> str:
+    return hashlib.blake2b(component.encode(), digest_size=16).hexdigest()
+
+
+def _raw_dict(base: str) -> zstandard.ZstdCompressionDict:
+    return zstandard.ZstdCompressionDict(base.encode(), dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+
+def _compress(component: str, base: t.Optional[str]) -> bytes:
+    if base is None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(component.encode())
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_raw_dict(base)).compress(component.encode())
+
+
+def _decompress(blob: bytes, base: t.Optional[str]) -> str:
+    if base is None:
+        return zstandard.ZstdDecompressor().decompress(blob).decode()
+    return zstandard.ZstdDecompressor(dict_data=_raw_dict(base)).decompress(blob).decode()
+
+
+def diff(old: str, new: str, old_name: str = "old", new_name: str = "new") -> str:
+    """Unified diff between two components."""
+    return "".join(difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True), fromfile=old_name, tofile=new_name
+    ))
+
+
+class ComponentRevisions:
+    """The component revision store of every app, in the apps Dict.
+
+    `add` is a read-modify-write of an app's index; callers serialize it per app (the directory calls
+    it from `set_app`, under the app's shard lock).
+    """
+
+    def __init__(self, store: modal.Dict):
+        self.store = store
+
+    @staticmethod
+    def index_key(app_id: str) -> str:
+        return f"app_{app_id}:revisions"
+
+    @staticmethod
+    def blob_key(app_id: str, digest: str) -> str:
+        return f"app_{app_id}:component@{digest}"
+
+    async def index(self, app_id: str) -> dict:
+        blob = await self.store.get.aio(self.index_key(app_id))
+        return storage.decode(blob) if blob is not None else {"entries": [], "blobs": {}}
+
+    async def add(
+        self, app_id: str, index: dict, component: str, previous: t.Optional[str], note: str, revision: int
+    ) -> dict:
+        """Record `component` as the app's newest revision and return the updated index.
+
+        `previous` is the component it replaces, used as the delta base; an app's first recorded edit
+        also records `previous` itself, so there is something to roll back to.
+        """
+        now = time.time()
+        writes = []
+
+        def remember(content: str, base: t.Optional[str], entry_note: str, entry_revision: int) -> None:
+            digest = content_hash(content)
+            if digest not in index["blobs"]:
+                base_digest = content_hash(base) if base is not None else None
+                base_info = index["blobs"].get(base_digest) if base_digest is not None else None
+                if base_info is None or base_info["depth"] >= MAX_DELTA_CHAIN:
+                    base, base_digest, depth = None, None, 0
+                else:
+                    depth = base_info["depth"] + 1
+                index["blobs"][digest] = {"base": base_digest, "depth": depth, "size": len(content)}
+                writes.append(self.store.put.aio(self.blob_key(app_id, digest), _compress(content, base)))
+            index["entries"].append({
+                "hash": digest, "revision": entry_revision, "at": now, "note": entry_note[:NOTE_MAX_LENGTH],
+            })
+
+        if not index["entries"] and previous is not None and previous != component:
+            remember(previous, None, "Before revision history", revision - 1)
+        remember(component, previous, note, revision)
+        dropped = self._prune(index)
+        writes.append(self.store.put.aio(self.index_key(app_id), storage.encode(index)))
+        writes.extend(self._discard(self.blob_key(app_id, digest)) for digest in dropped)
+        await asyncio.gather(*writes)
+        return index
+
+    @staticmethod
+    def _prune(index: dict) -> list[str]:
+        """Drop timeline entries past the limit, returning the hashes of blobs no longer needed."""
+        index["entries"] = index["entries"][-REVISION_HISTORY_LIMIT:]
+        needed: set[str] = set()
+        for entry in index["entries"]:
+            digest = entry["hash"]
+            while digest is not None and digest not in needed:
+                needed.add(digest)
+                digest = index["blobs"][digest]["base"]
+        dropped = [digest for digest in index["blobs"] if digest not in needed]
+        for digest in dropped:
+            del index["blobs"][digest]
+        return dropped
+
+    async def get(self, app_id: str, digest: str, index: t.Optional[dict] = None) -> t.Optional[str]:
+        """The component stored under `digest`, or None if the app has no such revision."""
+        if index is None:
+            index = await self.index(app_id)
+        if digest not in index["blobs"]:
+            return None
+        chain = []
+        while digest is not None:
+            chain.append(digest)
+            digest = index["blobs"][digest]["base"]
+        blobs = await asyncio.gather(*(self.store.get.aio(self.blob_key(app_id, link)) for link in chain))
+        if any(blob is None for blob in blobs):
+            print(f"[ComponentRevisions.get] Revision {chain[0]} of app {app_id} is missing part of its delta chain")
+            return None
+        component = None
+        for blob in reversed(blobs):
+            component = _decompress(blob, component)
+        return component
+
+    @staticmethod
+    def resolve(index: dict, ref: str) -> t.Optional[str]:
+        """The full hash for `ref`, a hash or an unambiguous prefix of one (at least 6 characters)."""
+        if ref in index["blobs"]:
+            return ref
+        matches = [digest for digest in index["blobs"] if len(ref) >= 6 and digest.startswith(ref)]
+        return matches[0] if len(matches) == 1 else None
+
+    async def _discard(self, key: str) -> None:
+        try:
+            await self.store.pop.aio(key)
+        except KeyError:
+            pass
+
+    async def discard_all(self, app_id: str) -> None:
+        """Delete an app's index and every blob it lists."""
+        index = await self.index(app_id)
+        await asyncio.gather(
+            self._discard(self.index_key(app_id)),
+            *(self._discard(self.blob_key(app_id, digest)) for digest in index["blobs"]),
+        )
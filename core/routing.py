@@ -0,0 +1,246 @@
+"""Routing of follow-up edits between a fast model and the full component model, by how complex the edit looks.
+
+Edits are scored with cheap heuristics on the request and the size of the component. Clearly simple
+edits ("make the title blue") go to the fast model, clearly complex ones ("add a dashboard with
+charts") to the full one; borderline scores are settled by a tiny classifier call when it is enabled,
+and go to the full model otherwise. The fast model is only asked for a patch; one that doesn't apply
+is escalated to the full model. Every decision and its outcome is recorded in `routing_stats`, so the thresholds
+below can be tuned from data.
+"""
+
+import asyncio
+import os
+import re
+import time
+import typing as t
+import uuid
+
+import anthropic
+
+from core.llm import generate_response
+from core.metrics import LATENCY_BUCKETS, Histogram
+
+SIMPLE = "simple"
+COMPLEX = "complex"
+
+# Words in an edit request that point to a small, local change (styling, colors, sizes, wording),
+# and to a structural one.
+SIMPLE_KEYWORDS = frozenset({
+    # Styling.
+    "align", "background", "bold", "border", "center", "darker", "font", "gap", "gradient", "italic",
+    "lighter", "margin", "opacity", "padding", "rounded", "shadow", "spacing", "underline", "uppercase",
+    # Colors.
+    "black", "blue", "color", "colour", "cyan", "gray", "green", "grey", "indigo", "orange", "pink",
+    "purple", "red", "teal", "white", "yellow",
+    # Sizes.
+    "bigger", "larger", "narrower", "shorter", "size", "smaller", "taller", "wider",
+    # Wording.
+    "caption", "heading", "label", "placeholder", "rename", "text", "title", "typo", "wording",
+})
+COMPLEX_KEYWORDS = frozenset({
+    "add", "animation", "api", "build", "chart", "charts", "create", "dashboard", "drag", "fetch", "filter",
+    "form", "game", "graph", "layout", "modal", "multiple", "new", "page", "pages", "redesign", "rewrite",
+    "search", "section", "sort", "state", "table", "tabs", "timer",
+})
+# Requests longer than these (in characters) add one point each towards complex.
+MESSAGE_LENGTH_STEPS = (160, 400)
+# Components longer than this (in characters) add a point: the fast model is more likely to botch a big file.
+LARGE_COMPONENT = 12_000
+# Scores at or below `SIMPLE_THRESHOLD` are simple, at or above `COMPLEX_THRESHOLD` complex; in between
+# is borderline.
+SIMPLE_THRESHOLD = -1
+COMPLEX_THRESHOLD = 1
+
+# Borderline edits are sent to this classifier when `EDIT_ROUTER_CLASSIFIER` is set; it answers in a
+# word, and an answer that doesn't arrive within the timeout counts as complex.
+ROUTER_MODEL = "claude-3-5-haiku-20241022"
+ROUTER_CLASSIFIER = os.getenv("EDIT_ROUTER_CLASSIFIER", "").lower() in ("1", "true", "yes")
+ROUTER_TIMEOUT = 2.0
+ROUTER_MAX_TOKENS = 4
+
+# Latest decisions kept per process (and in a merged view), for tuning the thresholds.
+ROUTING_LOG_LIMIT = 200
+ROUTING_SOURCE = os.getenv("MODAL_TASK_ID") or uuid.uuid4().hex
+# Shared snapshots older than this are from containers that have gone away.
+ROUTING_RETENTION = 24 * 3600
+
+_WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+class EditRoute(t.NamedTuple):
+    tier: str
+    score: int
+    # What settled the tier: "heuristic", "classifier", or "default" for an unsettled borderline score.
+    decided_by: str
+    signals: dict
+
+
+def score_edit(message: str, component: str) -> tuple[int, dict]:
+    """Complexity score of an edit (negative leans simple, positive complex) and the signals behind it."""
+    words = set(_WORD_PATTERN.findall(message.lower()))
+    simple_hits = sorted(words & SIMPLE_KEYWORDS)
+    complex_hits = sorted(words & COMPLEX_KEYWORDS)
+    length_points = sum(len(message) > step for step in MESSAGE_LENGTH_STEPS)
+    large_component = len(component) > LARGE_COMPONENT
+    score = len(complex_hits) - len(simple_hits) + length_points + int(large_component)
+    signals = {
+        "simple_keywords": simple_hits,
+        "complex_keywords": complex_hits,
+        "message_chars": len(message),
+        "component_chars": len(component),
+    }
+    return score, signals
+
+
+async def _classify(client: anthropic.Anthropic, message: str) -> t.Optional[str]:
+    prompt = f"""
+    A user asked for this change to an existing single-file React component:
+
+    {message}
+
+    Answer SIMPLE if it is a small, local change (text, colors, styling, spacing, a single element), or
+    COMPLEX if it adds features, sections, state or logic, or restructures the component. Answer with one word.
+    """
+    try:
+        answer = await asyncio.wait_for(
+            generate_response(
+                client, prompt, model=ROUTER_MODEL, max_tokens=ROUTER_MAX_TOKENS, temperature=0, purpose="route"
+            ),
+            ROUTER_TIMEOUT,
+        )
+    except Exception as e:
+        print(f"[routing] Classifier call failed: {e}")
+        return None
+    answer = answer.strip().upper()
+    if answer.startswith("SIMPLE"):
+        return SIMPLE
+    if answer.startswith("COMPLEX"):
+        return COMPLEX
+    return None
+
+
+async def route_edit(client: anthropic.Anthropic, message: str, component: str) -> EditRoute:
+    """Decide which tier a follow-up edit goes to."""
+    score, signals = score_edit(message, component)
+    if score <= SIMPLE_THRESHOLD:
+        return EditRoute(SIMPLE, score, "heuristic", signals)
+    if score >= COMPLEX_THRESHOLD:
+        return EditRoute(COMPLEX, score, "heuristic", signals)
+    if ROUTER_CLASSIFIER:
+        tier = await _classify(client, message)
+        if tier is not None:
+            return EditRoute(tier, score, "classifier", signals)
+    return EditRoute(COMPLEX, score, "default", signals)
+
+
+class RouteStats:
+    """Outcomes of the edits routed to one tier by one kind of decision."""
+
+    def __init__(self):
+        self.edits = 0
+        self.escalated = 0
+        self.failed = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+    def to_dict(self) -> dict:
+        return {
+            "edits": self.edits,
+            "escalated": self.escalated,
+            "failed": self.failed,
+            "latency_sec": self.latency.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RouteStats":
+        stats = cls()
+        stats.edits = data["edits"]
+        stats.escalated = data["escalated"]
+        stats.failed = data["failed"]
+        stats.latency = Histogram.from_dict(data["latency_sec"])
+        return stats
+
+    def merge(self, other: "RouteStats") -> None:
+        self.edits += other.edits
+        self.escalated += other.escalated
+        self.failed += other.failed
+        self.latency.merge(other.latency)
+
+
+class RoutingStats:
+    """Per-process aggregates of routed edits by tier and decision, plus the latest decisions in full."""
+
+    def __init__(self):
+        self.routes: dict[tuple[str, str], RouteStats] = {}
+        self.decisions: list[dict] = []
+
+    def record(self, route: EditRoute, model: str, latency: float, escalated: bool = False, failed: bool = False) -> None:
+        """Record how a routed edit went: `escalated` if the fast model's output was rejected, `failed` if no output was usable."""
+        stats = self.routes.setdefault((route.tier, route.decided_by), RouteStats())
+        stats.edits += 1
+        stats.escalated += int(escalated)
+        stats.failed += int(failed)
+        stats.latency.observe(latency)
+        self.decisions.append({
+            "at": time.time(),
+            "tier": route.tier,
+            "decided_by": route.decided_by,
+            "score": route.score,
+            "signals": route.signals,
+            "model": model,
+            "escalated": escalated,
+            "failed": failed,
+            "latency_sec": round(latency, 3),
+        })
+        del self.decisions[:-ROUTING_LOG_LIMIT]
+
+    def to_dict(self, recent: int = 50) -> dict:
+        return {
+            "routes": [
+                {"tier": tier, "decided_by": decided_by, **stats.to_dict()}
+                for (tier, decided_by), stats in sorted(self.routes.items())
+            ],
+            "thresholds": {"simple": SIMPLE_THRESHOLD, "complex": COMPLEX_THRESHOLD, "classifier": ROUTER_CLASSIFIER},
+            "recent": self.decisions[-recent:][::-1],
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "routes": [[tier, decided_by, stats.to_dict()] for (tier, decided_by), stats in self.routes.items()],
+            "decisions": self.decisions,
+        }
+
+    def merge_snapshot(self, snapshot: dict) -> None:
+        for tier, decided_by, data in snapshot["routes"]:
+            self.routes.setdefault((tier, decided_by), RouteStats()).merge(RouteStats.from_dict(data))
+        self.decisions = sorted(self.decisions + snapshot["decisions"], key=lambda decision: decision["at"])
+        del self.decisions[:-ROUTING_LOG_LIMIT]
+
+
+routing_stats = RoutingStats()
+
+
+async def publish_routing_stats(routing_dict) -> None:
+    """Save this process's routing stats to a shared Modal Dict, under a key of its own."""
+    try:
+        await routing_dict.put.aio(
+            f"source_{ROUTING_SOURCE}", {"updated_at": time.time(), "stats": routing_stats.snapshot()}
+        )
+    except Exception as e:
+        print(f"[routing] Failed to publish stats: {e}")
+
+
+async def collect_routing_stats(routing_dict) -> RoutingStats:
+    """Merge the routing stats every live process has published, dropping snapshots of containers long gone."""
+    merged = RoutingStats()
+    async for key in routing_dict.keys.aio():
+        entry = await routing_dict.get.aio(key)
+        if entry is None:
+            continue
+        if time.time() - entry["updated_at"] > ROUTING_RETENTION:
+            try:
+                await routing_dict.pop.aio(key)
+            except KeyError:
+                pass
+            continue
+        merged.merge_snapshot(entry["stats"])
+    return merged
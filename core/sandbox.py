@@ -1,18 +1,85 @@
 import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from core.history import HistorySummary, apply_summary, prompt_history, start_compaction
+from core.http_client import get_http_client
+from core.llm import llm_app_id
+from core.locks import DictLock, LockTimeout
+from core.tracing import TRACEPARENT_HEADER, add_span, span, traceparent
 from core.models import AppData, AppMetadata, AppStatus, Message, MessageType
-from core.prompt import generate_and_explain_init_edit, _generate_followup_edit, _explain_followup_edit
+from core import storage
+from core.revisions import ComponentRevisions
+from core.prompt import (
+    generate_and_explain_init_edit,
+    generate_seeded_init_edit,
+    generate_followup_edit,
+    _explain_followup_edit,
+    _stream_followup_edit,
+    _stream_followup_patch,
+    find_component_end,
+    followup_attempts,
+)
+from core.patch import PatchError, apply_patch, is_component_valid, parse_hunks
+from core.routing import route_edit, routing_stats
 import httpx
 import modal
 import anthropic
 from datetime import datetime
 import typing as t
 
+if t.TYPE_CHECKING:
+    from core.component_cache import ComponentCache
+    from core.pool import SandboxPool
+
+# Number of hash buckets the app catalogue is split across in the Modal Dict.
+CATALOGUE_SHARD_COUNT = 64
+CATALOGUE_LAYOUT_KEY = "catalogue_layout"
+CATALOGUE_LAYOUT = "sharded-v1"
+LEGACY_CATALOGUE_KEY = "catalogue"
+# Bumped on every catalogue write so containers can tell whether their cached copy is stale.
+CATALOGUE_VERSION_KEY = "catalogue_version"
+# How long a container trusts its cached catalogue before re-reading the version key.
+CATALOGUE_CACHE_TTL = 1.0
+# Field in each shard entry holding the catalogue version that last wrote it.
+ENTRY_VERSION_FIELD = "catalogue_version"
+# How long removal tombstones stay in their shard so delta listings can report them.
+TOMBSTONE_RETENTION = 3600.0
+# Delta listings re-send entries this close to the cursor, covering writers whose clocks trail slightly.
+DELTA_OVERLAP = 5.0
+# Heartbeats the cleanup job keeps in flight at once.
+CLEANUP_CONCURRENCY = 32
+HEARTBEAT_TIMEOUT = 10.0
+# Parsed `AppData` blobs each container keeps, least recently used evicted first.
+APP_CACHE_SIZE = 256
+# Field in each shard entry holding the revision of the app's data it was saved with.
+REVISION_FIELD = "revision"
+# Shard writes are read-modify-writes of entries shared by many apps, so they hold a short lock.
+SHARD_LOCK_TIMEOUT = 10.0
+SHARD_LOCK_WAIT = 5.0
+# An edit holds its app until its explanation is saved; a lease older than this is presumed abandoned.
+EDIT_LOCK_TIMEOUT = 300.0
+# How long an edit waits for the edits queued ahead of it before giving up.
+EDIT_LOCK_WAIT = 60.0
+EDIT_LOCK_POLL_INTERVAL = 0.25
+# Attempts a read-modify-write makes before reporting a conflict.
+WRITE_RETRIES = 3
+
 
 class SandboxApp:
     id: str
     metadata: t.Optional[AppMetadata] = None
     data: t.Optional[AppData] = None
     _wait_for_sandbox_alive_task: t.Optional[asyncio.Task] = None
+    # Set by `edit`/`edit_stream`: the explanation of the last edit, still being generated.
+    explanation_task: t.Optional[asyncio.Task] = None
+    # Set by `edit`/`edit_stream` when old turns are due to be folded into the history summary.
+    compaction_task: t.Optional[asyncio.Task] = None
+    # Parts of `data` as last read from or saved to the directory, `part -> (revision, value)`, so a
+    # save can skip the parts it didn't change. The revision is None for parts of a pre-format record.
+    stored_parts: t.Optional[dict[str, tuple[t.Optional[int], t.Any]]] = None
+    # Parts left out of a partial read (see `AppDirectory.get_app`); an app missing any can't be saved.
+    missing_parts: frozenset[str] = frozenset()
 
     @property
     def edit_url(self) -> str:
@@ -38,15 +105,70 @@ class SandboxApp:
         client: anthropic.Anthropic,
         message: str,
         image: modal.Image,
+        pool: t.Optional["SandboxPool"] = None,
+        component_cache: t.Optional["ComponentCache"] = None,
+        on_progress: t.Optional[t.Callable[[str], t.Awaitable[None]]] = None,
     ) -> "SandboxApp":
+        """Boot (or claim) a sandbox and generate its initial component concurrently, then push it.
+
+        `on_progress`, if given, is awaited with the name of each pipeline phase as it is reached.
+        """
         from sandbox.start_sandbox import run_sandbox_server_with_tunnel
 
-        create_sandbox_task = asyncio.create_task(
-            run_sandbox_server_with_tunnel(app=app, image=image)
-        )
-        create_init_edit_task = asyncio.create_task(
-            generate_and_explain_init_edit(client, message)
-        )
+        ready = False
+
+        async def report(phase: str) -> None:
+            if on_progress is not None:
+                await on_progress(phase)
+
+        async def boot_sandbox() -> tuple[str, str, str]:
+            sandbox = await claim_or_boot_sandbox()
+            await report("sandbox_booted")
+            return sandbox
+
+        async def generate_component() -> tuple[str, str]:
+            init_edit = await generate_init_edit()
+            await report("component_generated")
+            return init_edit
+
+        async def claim_or_boot_sandbox() -> tuple[str, str, str]:
+            nonlocal ready
+            if pool is not None:
+                with span("pool.claim") as attributes:
+                    claimed = await pool.claim(get_http_client())
+                    attributes["claimed"] = claimed is not None
+                if claimed is not None:
+                    ready = True
+                    return claimed
+            *sandbox, ready = await run_sandbox_server_with_tunnel(app=app, image=image)
+            return tuple(sandbox)
+
+        async def generate_init_edit() -> tuple[str, str]:
+            if component_cache is None:
+                return await generate_and_explain_init_edit(client, message)
+            with span("component_cache.get") as attributes:
+                cached = await component_cache.get(message)
+                attributes["hit"] = cached is not None
+            if cached is not None:
+                return cached
+            with span("component_cache.nearest") as attributes:
+                similar = await component_cache.nearest(message)
+                attributes["hit"] = similar is not None
+            if similar is not None:
+                seed_prompt, seed_component, _ = similar
+                edit, explanation = await generate_seeded_init_edit(client, message, seed_prompt, seed_component)
+            else:
+                edit, explanation = await generate_and_explain_init_edit(client, message)
+            try:
+                with span("component_cache.put"):
+                    await component_cache.put(message, edit, explanation)
+            except Exception as e:
+                print(f"[SandboxApp.create] Failed to cache initial component: {e}")
+            return edit, explanation
+
+        await report("booting_sandbox")
+        create_sandbox_task = asyncio.create_task(boot_sandbox())
+        create_init_edit_task = asyncio.create_task(generate_component())
         sandbox, init_edit = await asyncio.gather(create_sandbox_task, create_init_edit_task)
         sandbox_tunnel_url, sandbox_user_tunnel_url, sandbox_object_id = sandbox
         edit, explanation = init_edit
@@ -60,6 +182,7 @@ class SandboxApp:
                 updated_at=datetime.now(),
                 status=AppStatus.CREATED,
                 sandbox_user_tunnel_url=sandbox_user_tunnel_url,
+                sandbox_tunnel_url=sandbox_tunnel_url,
                 title=message,
             ),
             data=AppData(
@@ -74,16 +197,28 @@ class SandboxApp:
                 sandbox_object_id=sandbox_object_id,
             ),
         )
-        await sandbox_app._wait_for_sandbox_alive()
-        async with httpx.AsyncClient() as web_client:
-
-            response = await web_client.post(
+        if ready:
+            # The sandbox announced its servers are up (or, from the pool, answered a heartbeat when claimed).
+            sandbox_app.metadata.status = AppStatus.READY
+        else:
+            await report("waiting_for_sandbox")
+            with span("sandbox.wait_alive"):
+                await sandbox_app._wait_for_sandbox_alive()
+        await report("writing_component")
+        with span("sandbox.initial_edit"):
+            response = await get_http_client().post(
                     sandbox_app.edit_url,
                     json={"component": str(edit)},
+                    headers={TRACEPARENT_HEADER: traceparent()} if traceparent() else None,
                     timeout=60.0,
             )
-            print(f"Wrote initial edit to sandbox app: {response.status_code}")
-            response.raise_for_status()
+            # The sandbox server reports how long writing the component took in a Server-Timing header.
+            for metric in response.headers.get("server-timing", "").split(","):
+                name, _, duration = metric.strip().partition(";dur=")
+                if name and duration:
+                    add_span(f"sandbox.server.{name}", float(duration) / 1000)
+        print(f"Wrote initial edit to sandbox app: {response.status_code}")
+        response.raise_for_status()
         return sandbox_app
             
     
@@ -98,65 +233,173 @@ class SandboxApp:
         )
         
         original_html = self.data.current_component
-        async with httpx.AsyncClient() as web_client:
-            self.metadata.updated_at = datetime.now()
-            edit = await _generate_followup_edit(self.client, message, self.data.current_component, self.data.message_history)
-            self.data.current_component = edit
-            response = await web_client.post(
-                self.edit_url,
-                json={"component": str(edit)},
-                timeout=60.0,
-            )
-            response.raise_for_status()
-            explanation = await _explain_followup_edit(self.client, message, original_html, edit)
-            self.data.message_history.append(
-                Message(content=explanation, type=MessageType.ASSISTANT)
-            )
-            print(f"Write response status: {response.status_code}")
+        self.metadata.updated_at = datetime.now()
+        # Attributes this edit's LLM calls, including the background explanation and summary, to the app.
+        llm_app_id.set(self.id)
+        # Summarizing runs alongside the edit; this edit still uses the current summary.
+        self.compaction_task = start_compaction(self.client, self.data)
+        edit = await generate_followup_edit(self.client, message, self.data.current_component, prompt_history(self.data))
+        self.data.current_component = edit
+        response = await self._push_component(edit)
+        # The explanation is not needed to show the updated app; the caller attaches it to the history once it arrives.
+        self.explanation_task = asyncio.create_task(
+            _explain_followup_edit(self.client, message, original_html, edit)
+        )
+
+        self.metadata.status = AppStatus.ACTIVE
+        return response
+
+    async def edit_stream(self, message: str) -> t.AsyncIterator[dict]:
+        """Like `edit`, but yields the generated tokens as they arrive.
+
+        The same calls as in `edit` are made (see `followup_attempts`), streamed: patch hunks stream
+        in as `token` events and are applied and validated once complete. Each time an attempt's
+        output doesn't apply, a `restart` event is yielded and the next attempt's tokens follow. The
+        final fallback, a full component from the full model, is pushed to the sandbox as soon as its
+        closing brace has streamed in with nothing after it and it passes the structural check, and
+        pushed again at the end only if the model kept writing after it; nothing from an attempt that
+        may still be rejected is pushed. Then come a `component` event once the sandbox has the new
+        code and a final `done` event; the explanation is left generating in `explanation_task`.
+        """
+        if self.metadata.status not in (AppStatus.READY, AppStatus.ACTIVE):
+            raise ValueError("Sandbox is not ready or active")
+        self.data.message_history.append(
+            Message(content=message, type=MessageType.USER)
+        )
+
+        original_html = self.data.current_component
+        self.metadata.updated_at = datetime.now()
+        # Attributes this edit's LLM calls, including the background explanation and summary, to the app.
+        llm_app_id.set(self.id)
+        self.compaction_task = start_compaction(self.client, self.data)
+        started = time.monotonic()
+        route = await route_edit(self.client, message, original_html)
+        attempts = followup_attempts(route, original_html)
+        history = prompt_history(self.data)
+        for index, attempt in enumerate(attempts):
+            if index > 0:
+                yield {"type": "restart", "model": attempt.model}
+            text = ""
+            if attempt.patch:
+                async for delta in _stream_followup_patch(
+                    self.client, message, original_html, history, attempt.model, attempt.max_tokens
+                ):
+                    text += delta
+                    yield {"type": "token", "text": delta}
+                try:
+                    edit = apply_patch(original_html, text)
+                except PatchError as e:
+                    print(f"[SandboxApp.edit_stream] {attempt.model} patch could not be applied ({e})")
+                    continue
+                print(f"[SandboxApp.edit_stream] Applied {attempt.model} patch with {len(parse_hunks(text))} hunks")
+                response = await self._push_component(edit)
+                break
+
+            pushed: t.Optional[str] = None
+            push_task: t.Optional[asyncio.Task] = None
+            async for delta in _stream_followup_edit(
+                self.client, message, original_html, history, attempt.model, attempt.max_tokens
+            ):
+                text += delta
+                yield {"type": "token", "text": delta}
+                if push_task is None:
+                    end = find_component_end(text)
+                    # Text after the detected end means it was wrong (a `}` in a string) or helpers follow
+                    # the component; either way the final push covers it.
+                    if end is not None and not text[end:].strip() and is_component_valid(text[:end].strip()):
+                        pushed = text[:end].strip()
+                        push_task = asyncio.create_task(self._push_component(pushed))
+
+            edit = text.strip()
+            if push_task is not None:
+                response = await push_task
+            if push_task is None or edit != pushed:
+                response = await self._push_component(edit)
+            break
+        routing_stats.record(
+            route,
+            attempt.model,
+            time.monotonic() - started,
+            escalated=attempt.model != attempts[0].model,
+            failed=not is_component_valid(edit),
+        )
+        self.data.current_component = edit
+        self.explanation_task = asyncio.create_task(
+            _explain_followup_edit(self.client, message, original_html, edit)
+        )
+        yield {"type": "component", "status_code": response.status_code}
 
         self.metadata.status = AppStatus.ACTIVE
+        yield {"type": "done"}
+
+    async def rollback(self, component: str, label: str) -> httpx.Response:
+        """Put an earlier component back, pushing it straight to the sandbox without any LLM call."""
+        if self.metadata.status not in (AppStatus.READY, AppStatus.ACTIVE):
+            raise ValueError("Sandbox is not ready or active")
+        response = await self._push_component(component)
+        self.data.current_component = component
+        self.data.message_history.append(
+            Message(content=f"Rolled back to an earlier version ({label}).", type=MessageType.ASSISTANT)
+        )
+        self.metadata.updated_at = datetime.now()
+        self.metadata.status = AppStatus.ACTIVE
+        return response
+
+    async def _push_component(self, component: str) -> httpx.Response:
+        response = await get_http_client().post(
+            self.edit_url,
+            json={"component": str(component)},
+            timeout=60.0,
+        )
+        print(f"Write response status: {response.status_code}")
+        response.raise_for_status()
         return response
 
 
     async def _wait_for_sandbox_alive(self, max_attempts: int = 30, delay: float = 1.0):
         """Wait for the sandbox server to be ready by polling the heartbeat endpoint"""
-        async with httpx.AsyncClient() as client:
-            for attempt in range(max_attempts):
-                try:
-                    print(
-                        f"Health check attempt {attempt + 1}/{max_attempts} for {self.id}"
-                    )
-                    if await self.is_alive(client):
-                        print(f"✅ Sandbox server {self.id} is ready!")
-                        self.metadata.status = AppStatus.READY
-                        return
-                except Exception as e:
-                    print(f"Health check attempt {attempt + 1} failed: {str(e)}")
-                if attempt < max_attempts - 1:
-                    await asyncio.sleep(delay)
-            print(
-                f"❌ Sandbox server {self.id} failed to become ready after {max_attempts} attempts"
-            )
-            self.metadata.status = AppStatus.TERMINATED
+        client = get_http_client()
+        for attempt in range(max_attempts):
+            try:
+                print(
+                    f"Health check attempt {attempt + 1}/{max_attempts} for {self.id}"
+                )
+                if await self.is_alive(client):
+                    print(f"✅ Sandbox server {self.id} is ready!")
+                    self.metadata.status = AppStatus.READY
+                    return
+            except Exception as e:
+                print(f"Health check attempt {attempt + 1} failed: {str(e)}")
+            if attempt < max_attempts - 1:
+                await asyncio.sleep(delay)
+        print(
+            f"❌ Sandbox server {self.id} failed to become ready after {max_attempts} attempts"
+        )
+        self.metadata.status = AppStatus.TERMINATED
 
     async def is_alive(self, client: httpx.AsyncClient) -> bool:
         """Check if the sandbox server is alive by making a heartbeat request"""
         if self.metadata.status == AppStatus.TERMINATED:
             return False
-        heartbeat_url = f"{self.data.sandbox_tunnel_url}/heartbeat"
+        return await SandboxApp.heartbeat(client, self.id, self.data.sandbox_tunnel_url)
+
+    @staticmethod
+    async def heartbeat(client: httpx.AsyncClient, app_id: str, sandbox_tunnel_url: str) -> bool:
+        """Check a sandbox server by its relay tunnel URL alone, without loading the app's data."""
+        heartbeat_url = f"{sandbox_tunnel_url}/heartbeat"
         try:
-            response = await client.get(heartbeat_url, timeout=10.0)
+            response = await client.get(heartbeat_url, timeout=HEARTBEAT_TIMEOUT)
             return response.status_code == 200
         except Exception as e:
             # TODO(joy): if it is not alive, instead of deleting it, we should allow sandboxes to be reactivated.
-            print(f"Health check failed for {self.id}: {str(e)}")
+            print(f"Health check failed for {app_id}: {str(e)}")
             return False
     
-    def terminate(self) -> bool:
+    async def terminate(self) -> bool:
         """Terminate the sandbox using its object_id"""
         try:
-            sandbox = modal.Sandbox.from_id(self.data.sandbox_object_id)
-            sandbox.terminate()
+            sandbox = await modal.Sandbox.from_id.aio(self.data.sandbox_object_id)
+            await sandbox.terminate.aio()
             self.metadata.status = AppStatus.TERMINATED
             print(f"✅ Successfully terminated sandbox {self.id} (object_id: {self.data.sandbox_object_id})")
             return True
@@ -164,8 +407,98 @@ class SandboxApp:
             print(f"❌ Failed to terminate sandbox {self.id}: {str(e)}")
             return False
 
+class WriteConflict(Exception):
+    """Raised when saving an app that was changed (or removed) since it was read."""
+
+    def __init__(self, app_id: str, reason: str):
+        super().__init__(f"App {app_id} was not saved: {reason}")
+        self.app_id = app_id
+
+
+class EditLock:
+    """Holds one app for a single edit, from loading it until the edit's explanation is saved.
+
+    Edits to the same app queue up in arrival order on this container and take a lease in the Dict,
+    so edits made through other containers wait their turn too; edits to different apps never wait on
+    each other. `acquire` raises `LockTimeout` once it has waited `EDIT_LOCK_WAIT`.
+    """
+
+    def __init__(self, directory: "AppDirectory", app_id: str):
+        self.directory = directory
+        self.app_id = app_id
+        self._lease = DictLock(
+            directory.apps_dict, f"edit_lock_{app_id}",
+            timeout=EDIT_LOCK_TIMEOUT, wait=EDIT_LOCK_WAIT, poll_interval=EDIT_LOCK_POLL_INTERVAL,
+        )
+        self._local: t.Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        local = self.directory._edit_locks.setdefault(self.app_id, asyncio.Lock())
+        self.directory._edit_waiters[self.app_id] = self.directory._edit_waiters.get(self.app_id, 0) + 1
+        try:
+            try:
+                await asyncio.wait_for(local.acquire(), timeout=EDIT_LOCK_WAIT)
+            except asyncio.TimeoutError:
+                raise LockTimeout(f"App {self.app_id} is being edited")
+            try:
+                await self._lease.acquire()
+            except BaseException:
+                local.release()
+                raise
+        except BaseException:
+            self._leave()
+            raise
+        self._local = local
+
+    async def release(self) -> None:
+        if self._local is None:
+            return
+        local, self._local = self._local, None
+        try:
+            await self._lease.release()
+        finally:
+            local.release()
+            self._leave()
+
+    def _leave(self) -> None:
+        waiters = self.directory._edit_waiters[self.app_id] - 1
+        if waiters:
+            self.directory._edit_waiters[self.app_id] = waiters
+        else:
+            del self.directory._edit_waiters[self.app_id]
+            del self.directory._edit_locks[self.app_id]
+
+
 class AppDirectory:
-    """Manages the directory of created sandbox apps."""
+    """Manages the directory of created sandbox apps.
+
+    App metadata is stored in `CATALOGUE_SHARD_COUNT` hash-bucketed shards
+    (`catalogue_shard_{n}`) so that saving one app only rewrites the shard it
+    hashes to, while each app's `AppData` is stored compressed and split into a
+    core record and its component and history parts (see core/storage.py).
+
+    The loaded catalogue is cached in-process and tagged with the shared
+    `catalogue_version`; `refresh()` only reloads it when another writer has
+    bumped that version. Each shard entry also records the version that wrote
+    it, and removals leave short-lived tombstones, so `changes_since()` can
+    answer delta listings.
+
+    Decoded app data is cached per app, tagged with the entry version it was
+    read at; it is served only while the app's entry version in the
+    (refreshed) catalogue is unchanged. `set_app` writes through to this
+    cache, and `get_app` coalesces concurrent fetches of the same app into
+    one set of Dict reads.
+
+    Every method that touches the Dict is async and uses its `.aio` calls, so
+    a controller container serving many requests never blocks its event loop
+    on a Dict round trip.
+
+    Each app carries a revision. `set_app` is a compare-and-set against it,
+    made under a short per-shard lock, so a write based on a stale read raises
+    `WriteConflict` instead of silently dropping the other write;
+    `update_app` re-reads and retries. Edits additionally take an `EditLock`,
+    so edits to one app run one at a time.
+    """
     apps: dict[str, AppMetadata] = {}
 
     def __init__(self, apps_dict: modal.Dict, app: modal.App, client: anthropic.Anthropic):
@@ -173,102 +506,595 @@ class AppDirectory:
         self.app = app
         self.client = client
         self.apps = {}
+        self.version: t.Optional[int] = None
+        self._checked_at = 0.0
+        # Raw shard entries of the loaded apps, so unchanged entries skip pydantic validation on reload.
+        self._raw: dict[str, dict] = {}
+        # Catalogue version that last wrote each app, and of each tombstone still retained.
+        self.entry_versions: dict[str, int] = {}
+        self.removed: dict[str, int] = {}
+        # Callbacks invoked as `listener(change, app_id)` after this directory writes an app ("updated") or removes one ("removed").
+        self.listeners: list[t.Callable[[str, str], None]] = []
+        # app id -> (entry version the data was read at, core fields, parts read so far); most recently used last.
+        self._app_cache: OrderedDict[str, tuple[int, dict, dict[str, tuple[t.Optional[int], t.Any]]]] = OrderedDict()
+        # Fetches of app data in flight, shared by concurrent `get_app` calls for the same app and parts.
+        self._app_fetches: dict[tuple[str, frozenset[str]], asyncio.Task] = {}
+        # Catalogue reload in flight, shared by concurrent `load` calls.
+        self._loading: t.Optional[asyncio.Task] = None
+        # Per-app queues of edits on this container (see `EditLock`), dropped once nobody is waiting.
+        self._edit_locks: dict[str, asyncio.Lock] = {}
+        self._edit_waiters: dict[str, int] = {}
+        self.revisions = ComponentRevisions(apps_dict)
+
+    @staticmethod
+    def shard_for(app_id: str) -> int:
+        """Stable shard index for an app id (Python's `hash` is salted per process)."""
+        digest = hashlib.sha1(app_id.encode()).digest()
+        return int.from_bytes(digest[:4], "big") % CATALOGUE_SHARD_COUNT
+
+    @staticmethod
+    def _shard_key(shard: int) -> str:
+        return f"catalogue_shard_{shard}"
+
+    def _shard_lock(self, shard: int) -> DictLock:
+        return DictLock(self.apps_dict, f"catalogue_shard_lock_{shard}", timeout=SHARD_LOCK_TIMEOUT, wait=SHARD_LOCK_WAIT)
+
+    def edit_lock(self, app_id: str) -> EditLock:
+        return EditLock(self, app_id)
+
+    async def _migrate_legacy_catalogue(self) -> None:
+        """Split the old single `catalogue` blob into shards, once."""
+        if await self.apps_dict.get.aio(CATALOGUE_LAYOUT_KEY) == CATALOGUE_LAYOUT:
+            return
+        legacy = await self.apps_dict.get.aio(LEGACY_CATALOGUE_KEY, {})
+        shards: dict[int, dict] = {}
+        for app_id, app_data in legacy.items():
+            shards.setdefault(self.shard_for(app_id), {})[app_id] = app_data
+        for shard, entries in shards.items():
+            existing = await self.apps_dict.get.aio(self._shard_key(shard), {})
+            existing.update(entries)
+            await self.apps_dict.put.aio(self._shard_key(shard), existing)
+        await self.apps_dict.put.aio(CATALOGUE_LAYOUT_KEY, CATALOGUE_LAYOUT)
+        if legacy:
+            await self._discard(LEGACY_CATALOGUE_KEY)
+            print(f"[AppDirectory] Migrated {len(legacy)} apps from legacy catalogue into {len(shards)} shards")
+
+    async def load_page(
+        self, cursor: int = 0, shards_per_page: int = 8
+    ) -> tuple[dict[str, AppMetadata], dict[str, int], t.Optional[int]]:
+        """Load the apps stored in shards `[cursor, cursor + shards_per_page)`, reading the shards concurrently.
+
+        Returns the apps found, the retained tombstones (app id -> removal version) and the cursor of
+        the next page, or None once every shard has been read.
+        """
+        page: dict[str, AppMetadata] = {}
+        removed: dict[str, int] = {}
+        end = min(cursor + shards_per_page, CATALOGUE_SHARD_COUNT)
+        shards = await asyncio.gather(
+            *(self.apps_dict.get.aio(self._shard_key(shard), {}) for shard in range(cursor, end))
+        )
+        for shard_data in shards:
+            for app_id, app_data in shard_data.items():
+                if app_data.get("removed"):
+                    removed[app_id] = app_data.get(ENTRY_VERSION_FIELD, 0)
+                    continue
+                self.entry_versions[app_id] = app_data.get(ENTRY_VERSION_FIELD, 0)
+                if self._raw.get(app_id) == app_data and app_id in self.apps:
+                    page[app_id] = self.apps[app_id]
+                    continue
+                try:
+                    page[app_id] = AppMetadata.model_validate(app_data)
+                except Exception as e:
+                    print(f"Error loading metadata for app {app_id}: {e}")
+                    continue
+                self._raw[app_id] = app_data
+        return page, removed, (end if end < CATALOGUE_SHARD_COUNT else None)
+
+    async def load(self) -> None:
+        """Reload the whole catalogue. Concurrent calls share a single reload."""
+        load = self._loading
+        if load is None:
+            load = asyncio.create_task(self._load())
+            self._loading = load
+
+            def forget(_: asyncio.Task) -> None:
+                if self._loading is load:
+                    self._loading = None
 
+            load.add_done_callback(forget)
+        await asyncio.shield(load)
 
-    def load(self) -> None:
+    async def _load(self) -> None:
         try:
-            catalogue_data = self.apps_dict.get("catalogue", {})
-            self.apps = {app_id: AppMetadata.model_validate(app_data) 
-                        for app_id, app_data in catalogue_data.items()}
-            print(f"[AppDirectory.load] Loaded {len(self.apps)} apps from Modal Dict")
+            await self._migrate_legacy_catalogue()
+            # Read the version before the shards so a write racing with this load is picked up next refresh.
+            version = await self.apps_dict.get.aio(CATALOGUE_VERSION_KEY, 0)
+            apps: dict[str, AppMetadata] = {}
+            removed: dict[str, int] = {}
+            cursor: t.Optional[int] = 0
+            while cursor is not None:
+                page, page_removed, cursor = await self.load_page(cursor)
+                apps.update(page)
+                removed.update(page_removed)
+            self.apps = apps
+            self.removed = removed
+            self._raw = {app_id: raw for app_id, raw in self._raw.items() if app_id in apps}
+            self.entry_versions = {app_id: v for app_id, v in self.entry_versions.items() if app_id in apps}
+            self.version = version
+            self._checked_at = time.monotonic()
+            print(f"[AppDirectory.load] Loaded {len(self.apps)} apps from Modal Dict at version {version}")
         except Exception as e:
             print(f"Error loading apps from dict: {e}")
-            self.apps = {}
+            # Keep serving the last catalogue loaded; with no version, the next refresh reloads it.
+            self.version = None
+
+    async def refresh(self, ttl: float = CATALOGUE_CACHE_TTL) -> bool:
+        """Reload the catalogue only if its shared version changed; returns whether it was reloaded.
+
+        Within `ttl` seconds of the last check the cached copy is trusted without any Dict round trip.
+        """
+        now = time.monotonic()
+        if self.version is not None and now - self._checked_at < ttl:
+            return False
+        # Claim the check up front so requests arriving while the version is being read trust the cache.
+        self._checked_at = now
+        version = await self.apps_dict.get.aio(CATALOGUE_VERSION_KEY, 0)
+        if version == self.version:
+            return False
+        await self.load()
+        return True
+
+    def changes_since(self, since: int) -> t.Optional[tuple[dict[str, AppMetadata], list[str]]]:
+        """Apps written and removed after catalogue version `since`, from the cached catalogue.
+
+        Returns None when `since` predates the tombstone retention window, in which case the caller
+        has to fall back to a full listing. The window is measured back from the catalogue's own
+        version, like the pruning in `_write_shard`: a tombstone is only dropped by a write at least
+        `TOMBSTONE_RETENTION` newer than it, so a quiet catalogue keeps every cursor valid.
+        """
+        if self.version is None or since <= 0 or since < self.version - int(TOMBSTONE_RETENTION * 1_000_000):
+            return None
+        threshold = since - int(DELTA_OVERLAP * 1_000_000)
+        updated = {
+            app_id: metadata
+            for app_id, metadata in self.apps.items()
+            if self.entry_versions.get(app_id, 0) > threshold
+        }
+        removed = [app_id for app_id, v in self.removed.items() if v > threshold and app_id not in self.apps]
+        return updated, removed
+
+    async def _next_version(self) -> tuple[int, int]:
+        """Return the current shared catalogue version and the one the next write should publish.
+
+        The version is a microsecond timestamp (small enough to survive as a JS number) kept strictly
+        increasing, so two containers racing on the read-increment-write still each publish a value no
+        reader has cached yet.
+        """
+        previous = await self.apps_dict.get.aio(CATALOGUE_VERSION_KEY, 0)
+        return previous, max(previous + 1, time.time_ns() // 1000)
+
+    async def _publish_version(self, previous: int, version: int) -> None:
+        await self.apps_dict.put.aio(CATALOGUE_VERSION_KEY, version)
+        # Our cache already reflects this write; keep it only if nobody else wrote since we loaded.
+        self.version = version if previous == self.version else None
+
+    async def _write_shard(
+        self, shard: int, entries: dict[str, t.Optional[dict]], version: int, shard_data: t.Optional[dict] = None
+    ) -> dict:
+        """Apply several entry writes/tombstones to one shard in a single write, pruning expired tombstones.
+
+        The caller holds the shard's lock; `shard_data` is the shard as it already read it under that lock.
+        """
+        shard_key = self._shard_key(shard)
+        if shard_data is None:
+            shard_data = await self.apps_dict.get.aio(shard_key, {})
+        horizon = version - int(TOMBSTONE_RETENTION * 1_000_000)
+        shard_data = {
+            other_id: other for other_id, other in shard_data.items()
+            if not (other.get("removed") and other.get(ENTRY_VERSION_FIELD, 0) < horizon)
+        }
+        for app_id, entry in entries.items():
+            if entry is None:
+                shard_data[app_id] = {"removed": True, ENTRY_VERSION_FIELD: version}
+            else:
+                shard_data[app_id] = {**entry, ENTRY_VERSION_FIELD: version}
+        await self.apps_dict.put.aio(shard_key, shard_data)
+        return shard_data
     
-    async def cleanup(self, client: httpx.AsyncClient) -> None:
-        """Cleanup dead apps from the dict"""
+    async def cleanup(self, client: httpx.AsyncClient, concurrency: int = CLEANUP_CONCURRENCY) -> dict:
+        """Cleanup dead apps from the dict.
+
+        Heartbeats run concurrently (at most `concurrency` at a time) against the relay URL kept in
+        each app's metadata, and every dead app found is removed in one batched write at the end.
+        Returns a timing summary of the run.
+        """
         print("Cleaning up dead apps")
-        self.load()
+        started = time.monotonic()
+        await self.load()
+        loaded = time.monotonic()
         apps = self.apps.copy()
-        for app_id, metadata in apps.items():
-            print(f"Checking app {app_id}, last updated at {metadata.updated_at}, status {metadata.status}")
-            app = self.get_app(app_id)
-            if not app:
-                print(f"App {app_id} not found in directory")
-                self.remove_app(app_id)
-                continue
-            if not await app.is_alive(client):
-                print(f"App {app_id} is not alive")
-                self.remove_app(app_id)
-                continue
-            if app.metadata.status == AppStatus.TERMINATED:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def is_dead(app_id: str, metadata: AppMetadata) -> bool:
+            if metadata.status == AppStatus.TERMINATED:
                 print(f"App {app_id} is terminated")
-                print(f"Removing terminated app {app_id}")
-                self.remove_app(app_id)
+                return True
+            tunnel_url = metadata.sandbox_tunnel_url
+            if not tunnel_url:
+                # Apps saved before the relay URL was kept in metadata need their data to find it.
+                app = await self.get_app(app_id, parts=frozenset())
+                if not app:
+                    print(f"App {app_id} not found in directory")
+                    return True
+                tunnel_url = app.data.sandbox_tunnel_url
+            async with semaphore:
+                alive = await SandboxApp.heartbeat(client, app_id, tunnel_url)
+            if not alive:
+                print(f"App {app_id} is not alive")
+            return not alive
+
+        results = await asyncio.gather(*(is_dead(app_id, metadata) for app_id, metadata in apps.items()))
+        checked = time.monotonic()
+        dead = [app_id for app_id, is_app_dead in zip(apps, results) if is_app_dead]
+        if dead:
+            await self.remove_apps(dead)
+        finished = time.monotonic()
 
-    def set_app(self, app: SandboxApp) -> None:
-        """Save or update an app in the directory"""
+        summary = {
+            "apps": len(apps),
+            "removed": len(dead),
+            "load_sec": round(loaded - started, 3),
+            "check_sec": round(checked - loaded, 3),
+            "remove_sec": round(finished - checked, 3),
+            "total_sec": round(finished - started, 3),
+        }
+        print(f"[AppDirectory.cleanup] {summary}")
+        return summary
+
+    async def set_app(self, app: SandboxApp, revision_note: t.Optional[str] = None) -> None:
+        """Save or update an app in the directory.
+
+        A changed component is also recorded in the app's component revisions, noted with
+        `revision_note` (by default, the latest user message).
+
+        Raises `WriteConflict` if the stored app is no longer at the revision `app` was read at (or
+        was removed), and `LockTimeout` if its shard stays locked; other errors are logged.
+        """
+        if app.missing_parts:
+            raise ValueError(f"App {app.id} was read without its {', '.join(sorted(app.missing_parts))} and can't be saved")
+        shard = self.shard_for(app.id)
+        previous_component = (app.stored_parts or {}).get(storage.COMPONENT_PART, (None, None))[1]
+        component_changed = bool(app.data.current_component) and app.data.current_component != previous_component
+        if revision_note is None:
+            user_messages = [message.content for message in app.data.message_history if message.type == MessageType.USER]
+            revision_note = user_messages[-1] if user_messages else ""
         try:
+            app.metadata.message_count = len(app.data.message_history)
+            async with self._shard_lock(shard):
+                shard_data, (previous, version), revision_index = await asyncio.gather(
+                    self.apps_dict.get.aio(self._shard_key(shard), {}),
+                    self._next_version(),
+                    self.revisions.index(app.id) if component_changed else asyncio.sleep(0),
+                )
+                entry = shard_data.get(app.id)
+                if entry is not None and entry.get("removed"):
+                    raise WriteConflict(app.id, "it was removed")
+                current = entry.get(REVISION_FIELD, 0) if entry is not None else 0
+                if current != app.data.revision:
+                    raise WriteConflict(app.id, f"it is at revision {current}, not {app.data.revision}")
+                revision = current + 1
+
+                # Parts are written before the core record, and the core record before the shard entry, so a
+                # reader that sees the new entry version can't read (and cache under that version) older data.
+                core, parts = storage.split(app.data)
+                core["revision"] = revision
+                stored_parts = self._changed_parts(app, parts, revision)
+                await asyncio.gather(
+                    *(
+                        self.apps_dict.put.aio(storage.part_key(app.id, part), storage.encode([revision, parts[part]]))
+                        for part, (part_revision, _) in stored_parts.items() if part_revision == revision
+                    ),
+                    *([self.revisions.add(
+                        app.id, revision_index, app.data.current_component, previous_component, revision_note, revision
+                    )] if component_changed else []),
+                )
+                part_revisions = {part: part_revision for part, (part_revision, _) in stored_parts.items()}
+                await self.apps_dict.put.aio(
+                    storage.core_key(app.id), storage.encode([revision, {"fields": core, "parts": part_revisions}])
+                )
+                shard_data = await self._write_shard(
+                    shard, {app.id: {**app.metadata.model_dump(), REVISION_FIELD: revision}}, version, shard_data
+                )
+            app.data.revision = revision
+            app.stored_parts = stored_parts
             self.apps[app.id] = app.metadata
-            
-            catalogue_data = self.apps_dict.get("catalogue", {})
-            
-            catalogue_data[app.id] = app.metadata.model_dump()
-            
-            self.apps_dict["catalogue"] = catalogue_data
-            
-            app_data_dict = app.data.model_dump()
-            self.apps_dict[f"app_{app.id}"] = app_data_dict
+            self._raw[app.id] = shard_data[app.id]
+            self.entry_versions[app.id] = version
+            self.removed.pop(app.id, None)
+            self._remember_app(app.id, version, core, stored_parts)
+            await self._publish_version(previous, version)
                 
-            print(f"[AppDirectory.set_app] Saved app {app.id} to Modal Dict with {len(app.data.message_history)} messages and component of length {len(app.data.current_component)}")
-            print(f"[AppDirectory.set_app] Total apps in catalogue: {len(catalogue_data)}")
+            written = sorted(part for part, (part_revision, _) in stored_parts.items() if part_revision == revision)
+            print(f"[AppDirectory.set_app] Saved app {app.id} at revision {revision} with {len(app.data.message_history)} messages and component of length {len(app.data.current_component)} (wrote parts: {', '.join(written) or 'none'})")
+            print(f"[AppDirectory.set_app] Entries in shard {shard}: {len(shard_data)}")
+        except (WriteConflict, LockTimeout):
+            raise
         except Exception as e:
             print(f"Error saving app {app.id} to dict: {e}")
-    
-    def remove_app(self, app_id: str) -> None:
-        del self.apps[app_id]
-        
-        catalogue_data = {}
-        for remaining_app_id, metadata in self.apps.items():
-            catalogue_data[remaining_app_id] = metadata.model_dump()
-        
-        if f"app_{app_id}" in self.apps_dict:
-            self.apps_dict.pop(f"app_{app_id}")
-        self.apps_dict.put("catalogue", catalogue_data)
-        
-        if f"app_{app_id}" in self.apps_dict:
-            del self.apps_dict[f"app_{app_id}"]
-    
-    def get_app(self, app_id: str) -> t.Optional[SandboxApp]:
-        """Get an app from the directory"""
-        if app_id not in self.apps:
-            catalogue_data = self.apps_dict.get("catalogue", {})
-            if app_id not in catalogue_data:
+            return
+        self._notify("updated", app.id)
+
+    @staticmethod
+    def _changed_parts(
+        app: SandboxApp, parts: dict[str, t.Any], revision: int
+    ) -> dict[str, tuple[t.Optional[int], t.Any]]:
+        """The stored `(revision, value)` of each part once `app` is saved at `revision`.
+
+        A part equal to the one `app` was read with keeps its stored revision and isn't rewritten.
+        """
+        previous = app.stored_parts or {}
+        stored_parts = {}
+        for part, value in parts.items():
+            part_revision, stored_value = previous.get(part, (None, None))
+            unchanged = part_revision is not None and stored_value == value
+            stored_parts[part] = (part_revision if unchanged else revision, value)
+        return stored_parts
+
+    async def update_app(
+        self,
+        app_id: str,
+        change: t.Callable[[SandboxApp], None],
+        retries: int = WRITE_RETRIES,
+        revision_note: t.Optional[str] = None,
+    ) -> t.Optional[SandboxApp]:
+        """Apply `change` to a fresh read of an app and save it, re-reading and re-applying on conflict.
+
+        Returns the saved app, or None if the app no longer exists. Raises the last `WriteConflict`
+        once `retries` attempts have all lost to other writers. `revision_note` is passed to `set_app`.
+        """
+        for attempt in range(retries):
+            app = await self.get_app(app_id, use_cache=False)
+            if app is None:
+                print(f"[AppDirectory.update_app] App {app_id} no longer exists")
                 return None
+            change(app)
+            try:
+                await self.set_app(app, revision_note)
+                return app
+            except WriteConflict as e:
+                conflict = e
+                print(f"[AppDirectory.update_app] {e}; attempt {attempt + 1}/{retries}")
+        raise conflict
+
+    async def append_message(
+        self, app_id: str, message: Message, summary: t.Optional[HistorySummary] = None
+    ) -> t.Optional[SandboxApp]:
+        """Append a message to an app's saved history, re-reading it first so newer writes are kept.
+
+        `summary`, if given, is a history summary computed alongside the edit being explained; it is
+        stored in the same write.
+        """
+
+        def append(app: SandboxApp) -> None:
+            app.data.message_history.append(message)
+            if summary is not None and not apply_summary(app.data, summary):
+                print(f"[AppDirectory.append_message] Dropped stale history summary for app {app_id}")
+
+        return await self.update_app(app_id, append)
+
+    async def save_edit(self, app: SandboxApp, revision_note: t.Optional[str] = None) -> None:
+        """Save an app after an edit (or rollback) made under its `EditLock`.
+
+        Only metadata writes (e.g. featuring the app) can have landed since the edit read the app, so
+        on a conflict the edit's data is re-applied on top of them. Raises `WriteConflict` if the app
+        was removed meanwhile.
+        """
+        try:
+            await self.set_app(app, revision_note)
+            return
+        except WriteConflict as e:
+            print(f"[AppDirectory.save_edit] {e}; re-applying the edit")
+
+        def reapply(fresh: SandboxApp) -> None:
+            fresh.data = app.data.model_copy(update={"revision": fresh.data.revision})
+            fresh.metadata.status = app.metadata.status
+            fresh.metadata.updated_at = app.metadata.updated_at
+
+        saved = await self.update_app(app.id, reapply, revision_note=revision_note)
+        if saved is None:
+            raise WriteConflict(app.id, "it was removed")
+        app.data.revision = saved.data.revision
+
+    def _notify(self, change: str, app_id: str) -> None:
+        for listener in self.listeners:
             try:
-                self.apps[app_id] = AppMetadata.model_validate(catalogue_data[app_id])
+                listener(change, app_id)
             except Exception as e:
-                print(f"Error loading metadata for app {app_id}: {e}")
-                return None
-        
-        app_metadata = self.apps[app_id]
-        
-        app_data_dict = self.apps_dict.get(f"app_{app_id}")
-        if app_data_dict is None:
-            print(f"Inconsistent state: App data for {app_id} does not exist but app {app_id} is in the catalogue")
-            return None
-        
-        message_history = []
-        for msg_data in app_data_dict.get("message_history", []):
-            message_history.append(Message.model_validate(msg_data))
-        
-        app_data = AppData(
-            id=app_data_dict["id"],
-            message_history=message_history,
-            current_component=app_data_dict["current_component"],
-            sandbox_tunnel_url=app_data_dict["sandbox_tunnel_url"],
-            sandbox_user_tunnel_url=app_data_dict["sandbox_user_tunnel_url"],
-            sandbox_object_id=app_data_dict["sandbox_object_id"],
+                print(f"[AppDirectory] Listener failed for {change} {app_id}: {e}")
+    
+    async def _discard(self, key: str) -> None:
+        try:
+            await self.apps_dict.pop.aio(key)
+        except KeyError:
+            pass
+
+    async def remove_app(self, app_id: str) -> None:
+        await self.remove_apps([app_id])
+
+    async def remove_apps(self, app_ids: list[str]) -> None:
+        """Remove several apps with one write per affected shard and a single version bump."""
+        by_shard: dict[int, dict[str, t.Optional[dict]]] = {}
+        for app_id in app_ids:
+            self.apps.pop(app_id, None)
+            self._raw.pop(app_id, None)
+            self.entry_versions.pop(app_id, None)
+            self._app_cache.pop(app_id, None)
+            by_shard.setdefault(self.shard_for(app_id), {})[app_id] = None
+
+        previous, version = await self._next_version()
+
+        async def write_shard(shard: int, entries: dict[str, t.Optional[dict]]) -> None:
+            async with self._shard_lock(shard):
+                await self._write_shard(shard, entries, version)
+
+        await asyncio.gather(*(write_shard(shard, entries) for shard, entries in by_shard.items()))
+        for app_id in app_ids:
+            self.removed[app_id] = version
+        await asyncio.gather(
+            *(
+                self._discard(key)
+                for app_id in app_ids
+                for key in (storage.core_key(app_id), *(storage.part_key(app_id, part) for part in storage.APP_PARTS))
+            ),
+            *(self.revisions.discard_all(app_id) for app_id in app_ids),
         )
-        
-        return SandboxApp(app_id, self.client, app_metadata, app_data)
+        await self._publish_version(previous, version)
+        for app_id in app_ids:
+            self._notify("removed", app_id)
+    
+    def _remember_app(
+        self, app_id: str, version: t.Optional[int], core: dict, parts: dict[str, tuple[t.Optional[int], t.Any]]
+    ) -> None:
+        if not version:
+            return
+        cached = self._app_cache.get(app_id)
+        if cached is not None and cached[0] == version:
+            # Another read of the same version may have fetched other parts.
+            parts = {**cached[2], **parts}
+        self._app_cache[app_id] = (version, core, parts)
+        self._app_cache.move_to_end(app_id)
+        while len(self._app_cache) > APP_CACHE_SIZE:
+            self._app_cache.popitem(last=False)
+
+    def _build_app(
+        self, app_id: str, metadata: AppMetadata, core: dict,
+        stored_parts: dict[str, tuple[t.Optional[int], t.Any]], parts: frozenset[str],
+    ) -> SandboxApp:
+        # Built afresh from the stored values each time, since callers mutate the app they get back.
+        read = {part: stored_parts[part] for part in parts}
+        app = SandboxApp(app_id, self.client, metadata, storage.join(core, {part: value for part, (_, value) in read.items()}))
+        app.stored_parts = read
+        app.missing_parts = storage.APP_PARTS - parts
+        return app
+
+    def _cached_app(self, app_id: str, parts: frozenset[str]) -> t.Optional[SandboxApp]:
+        """The app from the per-app cache, if its entry version still matches the catalogue's and it has `parts`."""
+        cached = self._app_cache.get(app_id)
+        metadata = self.apps.get(app_id)
+        if cached is None or metadata is None or cached[0] != self.entry_versions.get(app_id) or not cached[2].keys() >= parts:
+            return None
+        self._app_cache.move_to_end(app_id)
+        return self._build_app(app_id, metadata, cached[1], cached[2], parts)
+
+    async def get_metadata(self, app_id: str) -> t.Optional[AppMetadata]:
+        """An app's catalogue entry alone, without fetching its data blob."""
+        await self.refresh()
+        if app_id in self.apps:
+            return self.apps[app_id]
+        return self._load_metadata(await self.apps_dict.get.aio(self._shard_key(self.shard_for(app_id)), {}), app_id)
+
+    def _load_metadata(self, shard_data: dict, app_id: str) -> t.Optional[AppMetadata]:
+        """Add (or refresh) an app's cached catalogue entry from its freshly read shard."""
+        if app_id not in shard_data or shard_data[app_id].get("removed"):
+            return None
+        try:
+            self.apps[app_id] = AppMetadata.model_validate(shard_data[app_id])
+        except Exception as e:
+            print(f"Error loading metadata for app {app_id}: {e}")
+            return None
+        self.entry_versions[app_id] = shard_data[app_id].get(ENTRY_VERSION_FIELD, 0)
+        return self.apps[app_id]
+
+    async def get_app(
+        self, app_id: str, use_cache: bool = True, parts: frozenset[str] = storage.APP_PARTS
+    ) -> t.Optional[SandboxApp]:
+        """Get an app from the directory.
+
+        Only the data `parts` asked for (a subset of `storage.APP_PARTS`) are read; the others are left
+        empty and the app can't be saved. Concurrent calls for the same app and parts that miss the
+        cache share a single fetch. With `use_cache` off the app's entry and data are re-read by a
+        fetch of their own, for read-modify-write callers that must not miss a write made elsewhere
+        in the last `CATALOGUE_CACHE_TTL`.
+        """
+        await self.refresh()
+        parts = frozenset(parts)
+        if not use_cache:
+            fetched = await self._fetch_app(app_id, parts, fresh=True)
+        else:
+            cached = self._cached_app(app_id, parts)
+            if cached is not None:
+                return cached
+            key = (app_id, parts)
+            fetch = self._app_fetches.get(key)
+            if fetch is None:
+                fetch = asyncio.create_task(self._fetch_app(app_id, parts))
+                self._app_fetches[key] = fetch
+
+                def forget(_: asyncio.Task) -> None:
+                    if self._app_fetches.get(key) is fetch:
+                        del self._app_fetches[key]
+
+                fetch.add_done_callback(forget)
+            fetched = await asyncio.shield(fetch)
+        if fetched is None:
+            return None
+        return self._build_app(app_id, *fetched, parts)
+
+    async def _fetch_app(
+        self, app_id: str, parts: frozenset[str], fresh: bool = False
+    ) -> t.Optional[tuple[AppMetadata, dict, dict[str, tuple[t.Optional[int], t.Any]]]]:
+        """Read an app's core record and the requested parts, plus its catalogue entry if `fresh` or not cached.
+
+        Parts are written before the core record, and the core record before the entry, so a read whose
+        pieces disagree on revisions caught a save half done and is read again.
+        """
+        ordered = sorted(parts)
+        keys = [storage.core_key(app_id), *(storage.part_key(app_id, part) for part in ordered)]
+        for attempt in range(WRITE_RETRIES):
+            read_entry = fresh or app_id not in self.apps
+            values = await asyncio.gather(
+                *([self.apps_dict.get.aio(self._shard_key(self.shard_for(app_id)), {})] if read_entry else []),
+                *(self.apps_dict.get.aio(key) for key in keys),
+            )
+            if read_entry:
+                shard_data, values = values[0], values[1:]
+                if self._load_metadata(shard_data, app_id) is None:
+                    return None
+            record, part_blobs = values[0], dict(zip(ordered, values[1:]))
+            if record is None:
+                print(f"Inconsistent state: App data for {app_id} does not exist but app {app_id} is in the catalogue")
+                return None
+            decoded = self._decode_app(record, part_blobs)
+            if decoded is not None:
+                core, stored_parts = decoded
+                entry = shard_data[app_id] if read_entry else None
+                if entry is None or entry.get(REVISION_FIELD, 0) == core.get("revision", 0):
+                    metadata = self.apps.get(app_id)
+                    if metadata is None:
+                        # Removed while its data was being read.
+                        return None
+                    self._remember_app(app_id, self.entry_versions.get(app_id), core, stored_parts)
+                    return metadata, core, stored_parts
+            await asyncio.sleep(0.05 * (attempt + 1))
+        print(f"[AppDirectory] Could not read a consistent copy of app {app_id}")
+        return None
+
+    @staticmethod
+    def _decode_app(
+        record: t.Any, part_blobs: dict[str, t.Optional[bytes]]
+    ) -> t.Optional[tuple[dict, dict[str, tuple[t.Optional[int], t.Any]]]]:
+        """The core fields and `part -> (revision, value)` of a stored app, or None if the parts read
+        don't belong to the core record read alongside them."""
+        if storage.is_legacy(record):
+            core, values = storage.split_legacy(record)
+            return core, {part: (None, values[part]) for part in part_blobs}
+        revision, body = storage.decode(record)
+        stored_parts = {}
+        for part, blob in part_blobs.items():
+            if blob is None:
+                return None
+            part_revision, value = storage.decode(blob)
+            if part_revision != body["parts"].get(part):
+                return None
+            stored_parts[part] = (part_revision, value)
+        return {**body["fields"], "revision": revision}, stored_parts
@@ -0,0 +1,99 @@
+"""MinHash signatures and an LSH index for finding prompts that differ from a new one by a word or two."""
+
+import hashlib
+import re
+import typing as t
+
+NUM_PERMUTATIONS = 64
+# Signatures are split into bands of this many rows; prompts sharing any whole band become candidates.
+# With 16 bands of 4 rows, pairs around 0.5 Jaccard similarity or above are very likely to collide.
+BAND_ROWS = 4
+# Estimated Jaccard similarity a candidate needs before its component is reused.
+SIMILARITY_THRESHOLD = 0.6
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _permutations(count: int) -> list[tuple[int, int]]:
+    """Deterministic `(a, b)` pairs for the universal hashes `(a * x + b) mod p`, identical in every container."""
+    pairs = []
+    for i in range(count):
+        digest = hashlib.sha256(f"minhash-{i}".encode()).digest()
+        a = int.from_bytes(digest[:8], "big") % (_MERSENNE_PRIME - 1) + 1
+        b = int.from_bytes(digest[8:16], "big") % _MERSENNE_PRIME
+        pairs.append((a, b))
+    return pairs
+
+
+_PERMUTATIONS = _permutations(NUM_PERMUTATIONS)
+
+
+def shingles(text: str) -> set[str]:
+    """Words and word pairs of `text`, so both vocabulary and word order count towards similarity."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+
+def signature(text: str) -> list[int]:
+    features = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), "big")
+        for shingle in shingles(text)
+    ]
+    if not features:
+        return [_MAX_HASH] * NUM_PERMUTATIONS
+    return [
+        min(((a * x + b) % _MERSENNE_PRIME) & _MAX_HASH for x in features)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def similarity(first: t.Sequence[int], second: t.Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the texts two signatures were computed from."""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+def _bands(sig: t.Sequence[int]) -> list[tuple[int, ...]]:
+    return [
+        (index, *sig[start:start + BAND_ROWS])
+        for index, start in enumerate(range(0, len(sig), BAND_ROWS))
+    ]
+
+
+class PromptIndex:
+    """Locality-sensitive hash index from signatures to the keys they were added under."""
+
+    def __init__(self, signatures: t.Optional[dict[str, list[int]]] = None):
+        self.signatures: dict[str, list[int]] = {}
+        self._buckets: dict[tuple[int, ...], set[str]] = {}
+        for key, sig in (signatures or {}).items():
+            self.add(key, sig)
+
+    def add(self, key: str, sig: list[int]) -> None:
+        self.remove(key)
+        self.signatures[key] = sig
+        for band in _bands(sig):
+            self._buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        sig = self.signatures.pop(key, None)
+        if sig is None:
+            return
+        for band in _bands(sig):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def nearest(self, sig: list[int], threshold: float = SIMILARITY_THRESHOLD) -> t.Optional[tuple[str, float]]:
+        """The most similar indexed key at or above `threshold`, with its estimated similarity."""
+        candidates = set()
+        for band in _bands(sig):
+            candidates |= self._buckets.get(band, set())
+        best = None
+        for key in candidates:
+            score = similarity(sig, self.signatures[key])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
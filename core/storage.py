@@ -0,0 +1,78 @@
+"""Compact storage of `AppData` in the apps Dict: msgpack + zstd, split into a core record and separate parts.
+
+An app's data is stored under three keys:
+- `app_{id}`: the core record (sandbox ids and URLs, history summary, revision), plus the revision of
+  each part it was saved with.
+- `app_{id}:component`: the current component source.
+- `app_{id}:history`: the message history, as `[type, content]` pairs.
+
+Each value is `[revision, value]`, packed and compressed behind a one-byte format version. Reads that
+only need some of the app (e.g. its URLs, or its history) skip the parts they don't need, and saves
+skip parts that didn't change. Records written before this format are plain `AppData.model_dump()`
+dicts under `app_{id}`; they are still read, and replaced by the new format on their next save.
+"""
+
+import typing as t
+
+import msgpack
+import zstandard
+
+from core.models import AppData, Message, MessageType
+
+FORMAT_VERSION = 1
+ZSTD_LEVEL = 3
+COMPONENT_PART = "component"
+HISTORY_PART = "history"
+APP_PARTS = frozenset({COMPONENT_PART, HISTORY_PART})
+_PART_FIELDS = ("current_component", "message_history")
+
+_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def core_key(app_id: str) -> str:
+    return f"app_{app_id}"
+
+
+def part_key(app_id: str, part: str) -> str:
+    return f"app_{app_id}:{part}"
+
+
+def encode(value: t.Any) -> bytes:
+    return bytes([FORMAT_VERSION]) + _compressor.compress(msgpack.packb(value, use_bin_type=True))
+
+
+def decode(blob: bytes) -> t.Any:
+    if not blob or blob[0] != FORMAT_VERSION:
+        raise ValueError(f"Unknown app storage format {blob[:1]!r}")
+    return msgpack.unpackb(_decompressor.decompress(blob[1:]), raw=False)
+
+
+def is_legacy(record: t.Any) -> bool:
+    """Whether an `app_{id}` record predates this format (a plain `AppData` dict holding everything)."""
+    return isinstance(record, dict)
+
+
+def split(data: AppData) -> tuple[dict, dict[str, t.Any]]:
+    """The core fields of `data` and the value of each of its parts."""
+    core = {name: getattr(data, name) for name in AppData.model_fields if name not in _PART_FIELDS}
+    parts = {
+        COMPONENT_PART: data.current_component,
+        HISTORY_PART: [[message.type.value, message.content] for message in data.message_history],
+    }
+    return core, parts
+
+
+def join(core: dict, parts: dict[str, t.Any]) -> AppData:
+    """Build `AppData` from stored values without re-validating them; parts not given are left empty."""
+    history = parts.get(HISTORY_PART) or []
+    return AppData.model_construct(
+        **core,
+        current_component=parts.get(COMPONENT_PART) or "",
+        message_history=[Message.model_construct(content=content, type=MessageType(kind)) for kind, content in history],
+    )
+
+
+def split_legacy(record: dict) -> tuple[dict, dict[str, t.Any]]:
+    """The core fields and part values of a pre-format record, validated as it always was."""
+    return split(AppData.model_validate(record))
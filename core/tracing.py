@@ -0,0 +1,193 @@
+"""Span-based tracing of the create-app pipeline, from the controller through the create function into the sandbox."""
+
+import contextlib
+import contextvars
+import json
+import re
+import time
+import typing as t
+import uuid
+
+import modal
+
+# Traces kept in the store; older ones are dropped as new ones are saved.
+TRACE_RETENTION_COUNT = 1000
+TRACE_INDEX_KEY = "__index__"  # [[trace_id, saved_at], ...], oldest first
+TRACEPARENT_HEADER = "traceparent"
+
+_TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Trace:
+    """The spans recorded in this process for one trace id."""
+
+    def __init__(self, trace_id: t.Optional[str] = None, parent_span_id: t.Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        # Span in another process that this process's top-level spans are children of.
+        self.parent_span_id = parent_span_id
+        self.spans: list[dict] = []
+
+
+_current_trace: contextvars.ContextVar[t.Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span_id: contextvars.ContextVar[t.Optional[str]] = contextvars.ContextVar("current_span_id", default=None)
+
+
+def start_trace(trace_id: t.Optional[str] = None, parent_span_id: t.Optional[str] = None) -> Trace:
+    """Make a trace current for this task and the tasks it creates from here on."""
+    trace = Trace(trace_id, parent_span_id)
+    _current_trace.set(trace)
+    _current_span_id.set(None)
+    return trace
+
+
+def current_trace() -> t.Optional[Trace]:
+    return _current_trace.get()
+
+
+def _record(trace: Trace, name: str, span_id: str, parent_id: t.Optional[str], started_at: float, duration: float, attributes: dict) -> dict:
+    record = {
+        "trace_id": trace.trace_id,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "name": name,
+        "started_at": started_at,
+        "duration_sec": duration,
+        "attributes": attributes,
+    }
+    trace.spans.append(record)
+    return record
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> t.Iterator[dict]:
+    """Time the enclosed block as a span of the current trace; a no-op when no trace is current.
+
+    Yields the span's attribute dict, so callers can attach results (e.g. whether a cache hit).
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _current_span_id.get() or trace.parent_span_id
+    token = _current_span_id.set(span_id)
+    started_at = time.time()
+    started = time.monotonic()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span_id.reset(token)
+        _record(trace, name, span_id, parent_id, started_at, time.monotonic() - started, attributes)
+
+
+def add_span(name: str, duration: float, **attributes) -> None:
+    """Record a span measured elsewhere (e.g. reported by the sandbox) as a child of the current span."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    parent_id = _current_span_id.get() or trace.parent_span_id
+    _record(trace, name, uuid.uuid4().hex[:16], parent_id, time.time() - duration, duration, attributes)
+
+
+def traceparent() -> t.Optional[str]:
+    """W3C `traceparent` header value for the current span, to propagate the trace to another service."""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    span_id = _current_span_id.get() or trace.parent_span_id or "0" * 16
+    return f"00-{trace.trace_id}-{span_id}-01"
+
+
+def parse_traceparent(header: t.Optional[str]) -> tuple[t.Optional[str], t.Optional[str]]:
+    """`(trace_id, parent_span_id)` from a `traceparent` header, or `(None, None)` if it is missing or malformed."""
+    match = _TRACEPARENT_PATTERN.match((header or "").strip().lower())
+    if match is None:
+        return None, None
+    trace_id, span_id = match.groups()
+    # An all-zero span id is what `traceparent()` sends when there is no current span.
+    return trace_id, None if span_id == "0" * 16 else span_id
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(spans: t.Iterable[dict]) -> dict:
+    """p50/p95/max duration of each span name (phase) across the given spans."""
+    durations: dict[str, list[float]] = {}
+    for record in spans:
+        durations.setdefault(record["name"], []).append(record["duration_sec"])
+    return {
+        name: {
+            "count": len(values),
+            "p50": round(_percentile(values, 0.5), 4),
+            "p95": round(_percentile(values, 0.95), 4),
+            "max": round(max(values), 4),
+        }
+        for name, values in sorted(durations.items())
+    }
+
+
+class TraceStore:
+    """Finished traces in a Modal Dict under `trace_{id}`, with an index capping how many are kept.
+
+    Each process saves the spans it recorded; spans of a trace saved from several processes (the
+    controller and the create function) are appended together under the same key.
+    """
+
+    def __init__(self, traces_dict: modal.Dict, retention: int = TRACE_RETENTION_COUNT):
+        self.traces_dict = traces_dict
+        self.retention = retention
+
+    async def save(self, trace: Trace) -> None:
+        if not trace.spans:
+            return
+        try:
+            key = f"trace_{trace.trace_id}"
+            spans = await self.traces_dict.get.aio(key, [])
+            await self.traces_dict.put.aio(key, spans + trace.spans)
+            trace.spans = []
+            if not spans:
+                await self._index(trace.trace_id)
+        except Exception as e:
+            print(f"[TraceStore.save] Failed to save trace {trace.trace_id}: {e}")
+
+    async def _index(self, trace_id: str) -> None:
+        index = await self.traces_dict.get.aio(TRACE_INDEX_KEY, [])
+        index.append([trace_id, time.time()])
+        for expired_id, _ in index[:-self.retention]:
+            try:
+                await self.traces_dict.pop.aio(f"trace_{expired_id}")
+            except KeyError:
+                pass
+        await self.traces_dict.put.aio(TRACE_INDEX_KEY, index[-self.retention:])
+
+    async def get(self, trace_id: str) -> list[dict]:
+        return await self.traces_dict.get.aio(f"trace_{trace_id}", [])
+
+    async def recent(self, limit: int = TRACE_RETENTION_COUNT) -> list[list[dict]]:
+        index = await self.traces_dict.get.aio(TRACE_INDEX_KEY, [])
+        traces = []
+        for trace_id, _ in index[-limit:]:
+            spans = await self.get(trace_id)
+            if spans:
+                traces.append(spans)
+        return traces
+
+    async def summary(self, limit: int = TRACE_RETENTION_COUNT) -> dict:
+        traces = await self.recent(limit)
+        return {"traces": len(traces), "phases": summarize(record for spans in traces for record in spans)}
+
+    async def export_jsonl(self, path: str, limit: int = TRACE_RETENTION_COUNT) -> int:
+        """Write the spans of recent traces to `path`, one JSON object per line; returns the span count."""
+        count = 0
+        with open(path, "w") as f:
+            for spans in await self.recent(limit):
+                for record in spans:
+                    f.write(json.dumps(record) + "\n")
+                    count += 1
+        return count
@@ -42,19 +42,31 @@ app = modal.App(name="modal-vibe-loadtest", image=image)
     timeout=3600,
 )
 @modal.concurrent(max_inputs=1000)
-async def make_create_app_request(prompt: str):
+async def make_create_app_request(prompt: str, request_key: str):
+    import asyncio
     import httpx
 
     API_URL = "https://modal-labs-joy-dev--modal-vibe-fastapi-app.modal.run"
     num_retries = 5
     for i in range(num_retries):
         try:
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                response = await client.post(f"{API_URL}/api/create", json={"prompt": prompt})
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                # The request key makes retries return the job the first attempt started.
+                response = await client.post(f"{API_URL}/api/create", json={"prompt": prompt, "request_key": request_key})
+                if response.status_code == 429:
+                    # Creation is saturated; wait as long as the server asks before trying again.
+                    await asyncio.sleep(float(response.headers.get("Retry-After", "5")))
+                    continue
                 response.raise_for_status()
-                result = response.json()
-                app_id = result["app_id"]
-                return app_id
+                job = response.json()
+                while job["status"] not in ("active", "failed"):
+                    await asyncio.sleep(1.0)
+                    response = await client.get(f"{API_URL}/api/jobs/{job['job_id']}")
+                    response.raise_for_status()
+                    job = response.json()
+                if job["status"] == "failed":
+                    raise Exception(f"Create job {job['job_id']} failed: {job['error']}")
+                return job["app_id"]
         except Exception as e:
             continue
     raise Exception(f"Failed to create app after {num_retries} retries")
@@ -69,6 +81,7 @@ async def make_create_app_request(prompt: str):
 async def create_app_loadtest_function(num_apps: int = 100):
     import time
     import asyncio
+    import uuid
     from typing import Any
 
     start_time = time.time()
@@ -90,14 +103,15 @@ async def create_app_loadtest_function(num_apps: int = 100):
     async def create_app_with_limit(prompt: str, index: int) -> Any | None:
         print(f"Creating app with prompt: {prompt}")
         async with semaphore:
+            request_key = uuid.uuid4().hex
             delays = [0, 0.1, 0.5]  # seconds
             for attempt, delay in enumerate([0, *delays], start=1):
                 if delay:
                     await asyncio.sleep(delay)
                 try:
                     return await asyncio.wait_for(
-                        make_create_app_request.remote.aio(prompt),
-                        timeout=30,
+                        make_create_app_request.remote.aio(prompt, request_key),
+                        timeout=300,
                     )
                 except asyncio.TimeoutError:
                     if attempt == len(delays) + 1:
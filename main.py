@@ -1,10 +1,27 @@
 """Main entrypoint that runs the FastAPI controller that serves the web app and manages the sandbox apps."""
 
+import asyncio
+import hashlib
+import json
 import os
+import time
 from datetime import datetime
-
-from core.llm import get_llm_client
-from core.sandbox import AppDirectory, SandboxApp
+from typing import Optional
+
+from core.admission import AdmissionController, AdmissionRejected
+from core.component_cache import ComponentCache
+from core.events import GALLERY_TOPIC, CatalogueWatcher, Event, EventBus
+from core.http_client import close_http_client, get_http_client
+from core.jobs import JOB_POLL_INTERVAL, CreateJobs, JobStatus
+from core.locks import LockTimeout
+from core.models import AppMetadata, AppStatus, Message, MessageType
+from core.llm import collect_llm_metrics, get_llm_client, llm_metrics, prompt_cache_stats, publish_llm_metrics
+from core.pool import SandboxPool
+from core.revisions import ComponentRevisions, diff as revision_diff
+from core.routing import collect_routing_stats, publish_routing_stats, routing_stats
+from core.sandbox import CLEANUP_CONCURRENCY, EDIT_LOCK_WAIT, AppDirectory, EditLock, SandboxApp, WriteConflict
+from core.storage import APP_PARTS, HISTORY_PART
+from core.tracing import TRACEPARENT_HEADER, TraceStore, parse_traceparent, span, start_trace, summarize, traceparent
 import modal
 from dotenv import load_dotenv
 from modal import Dict
@@ -15,6 +32,20 @@ llm_client = get_llm_client()
 # Persist Sandbox application metadata in a Modal Dict so it can be shared across containers and restarts.
 # This will create the dict on first run if it does not already exist.
 apps_dict = Dict.from_name("sandbox-apps", create_if_missing=True)
+# Booted, heartbeat-verified sandboxes waiting to be claimed by create_sandbox_app.
+sandbox_pool_queue = modal.Queue.from_name("sandbox-pool", create_if_missing=True)
+# Initial components generated for earlier prompts, keyed by model, prompt template and normalized prompt.
+component_cache_dict = Dict.from_name("component-cache", create_if_missing=True)
+# Latest LLM call metrics of each container that has made calls, merged by /api/llm/metrics.
+llm_metrics_dict = Dict.from_name("llm-metrics", create_if_missing=True)
+# Follow-up edit routing decisions and outcomes of each controller container, merged by /api/llm/routing.
+routing_dict = Dict.from_name("edit-routing", create_if_missing=True)
+# Spans of recent create-app traces, written by the controller and the create function.
+traces_dict = Dict.from_name("create-traces", create_if_missing=True)
+# Create-app jobs and the client request keys that map to them.
+jobs_dict = Dict.from_name("create-jobs", create_if_missing=True)
+# Queue of create jobs waiting for a slot and the slots in use (see core/admission.py).
+admission_dict = Dict.from_name("create-admission", create_if_missing=True)
 
 core_image = (
     modal.Image.debian_slim()
@@ -23,10 +54,12 @@ core_image = (
         "fastapi[standard]",
         "jinja2",
         "python-multipart",
-        "httpx",
+        "httpx[http2]",
         "python-dotenv",
         "anthropic",
         "tqdm",
+        "msgpack",
+        "zstandard",
     )
     .add_local_dir("core", "/root/core")
 )
@@ -76,18 +109,62 @@ sandbox_image = (
     secrets=[modal.Secret.from_name("anthropic-secret")],
     timeout=3600,
 )
-async def create_sandbox_app(prompt: str) -> str:    
+async def create_sandbox_app(prompt: str, trace_parent: Optional[str] = None, job_id: Optional[str] = None) -> str:    
+    """Create an app for `prompt` and return its id, reporting progress on the create job `job_id` if given."""
     print(f"Creating sandbox app with prompt: {prompt}")
-    
-    app_directory = AppDirectory(apps_dict, app, llm_client)
-    print("Initialized app directory")
-    sandbox_app = await SandboxApp.create(app, llm_client, prompt, image=sandbox_image)
-    app_directory.set_app(sandbox_app)
+    trace = start_trace(*parse_traceparent(trace_parent))
+    jobs = CreateJobs(jobs_dict)
+    try:
+        # Inside the try, so the slot is released even if this first update fails.
+        if job_id is not None:
+            await jobs.update(job_id, phase="started", status=JobStatus.RUNNING)
+        with span("create_sandbox_app") as attributes:
+            app_directory = AppDirectory(apps_dict, app, llm_client)
+            print("Initialized app directory")
+            pool = SandboxPool(sandbox_pool_queue, app, sandbox_image)
+            sandbox_app = await SandboxApp.create(
+                app, llm_client, prompt, image=sandbox_image, pool=pool,
+                component_cache=ComponentCache(component_cache_dict),
+                on_progress=jobs.progress(job_id),
+            )
+            attributes["app_id"] = sandbox_app.id
+            with span("catalogue.save"):
+                await app_directory.set_app(sandbox_app)
+    except Exception as e:
+        if job_id is not None:
+            await jobs.update(job_id, phase="failed", status=JobStatus.FAILED, error=str(e))
+        raise
+    finally:
+        await TraceStore(traces_dict).save(trace)
+        if job_id is not None:
+            # Hand this job's slot to the next queued create.
+            admission = AdmissionController(admission_dict)
+            try:
+                await admission.release(job_id, start_create_job)
+            except AdmissionRejected as e:
+                print(f"Failed to release the admission slot of job {job_id}: {e}")
+    if job_id is not None:
+        await jobs.update(job_id, phase="active", status=JobStatus.ACTIVE, app_id=sandbox_app.id)
+    await publish_llm_metrics(llm_metrics_dict)
+    if await pool.needs_refill():
+        await refill_sandbox_pool.spawn.aio()
     print(f"Created image {sandbox_image.object_id}")
     print(f"Created and saved sandbox app with ID: {sandbox_app.id}")
     
     return sandbox_app.id
 
+async def start_create_job(job_id: str) -> None:
+    """Spawn the create function for a job that has been given an admission slot."""
+    jobs = CreateJobs(jobs_dict)
+    job = await jobs.get(job_id)
+    if job is None:
+        raise ValueError(f"Job {job_id} not found")
+    try:
+        await create_sandbox_app.spawn.aio(job["prompt"], job.get("trace_parent"), job_id)
+    except Exception as e:
+        await jobs.update(job_id, phase="failed", status=JobStatus.FAILED, error=str(e))
+        raise
+
 @app.function(
     image=image,
     secrets=[modal.Secret.from_name("anthropic-secret"), modal.Secret.from_name("admin-secret")],
@@ -97,21 +174,24 @@ async def create_sandbox_app(prompt: str) -> str:
 @modal.asgi_app(custom_domains=["vibes.modal.chat"])
 def fastapi_app():
     from fastapi import FastAPI, Request, HTTPException
-    from fastapi.responses import JSONResponse
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
     from fastapi.staticfiles import StaticFiles
     from fastapi.templating import Jinja2Templates
     from pydantic import BaseModel
-    import httpx
 
     app_directory = AppDirectory(apps_dict, app, llm_client)
-    app_directory.load()
-
+    event_bus = EventBus()
+    catalogue_watcher = CatalogueWatcher(app_directory, event_bus)
 
     class CreateAppRequest(BaseModel):
         prompt: str
+        # Sent again on retries so a retried create returns the original job instead of starting another.
+        request_key: Optional[str] = None
         
     class CreateAppResponse(BaseModel):
-        app_id: str
+        job_id: str
+        status: str
+        app_id: Optional[str] = None
     
     class WriteAppRequest(BaseModel):
         text: str
@@ -124,6 +204,10 @@ def fastapi_app():
 
     class SnapshotAppRequest(BaseModel):
         admin_secret: str
+
+    class RollbackAppRequest(BaseModel):
+        # Hash of the component revision to restore, or an unambiguous prefix of it.
+        revision: str
         
 
     web_app = FastAPI(
@@ -135,12 +219,113 @@ def fastapi_app():
 
     templates = Jinja2Templates(directory="/root/web/templates")
 
-    def _get_app_or_raise(app_id: str) -> SandboxApp:
-        sandbox_app = app_directory.get_app(app_id)
+    @web_app.on_event("startup")
+    async def start_catalogue_watcher():
+        await app_directory.load()
+        catalogue_watcher.start()
+
+    @web_app.on_event("shutdown")
+    async def stop_catalogue_watcher():
+        await catalogue_watcher.stop()
+        await close_http_client()
+
+    async def _event_stream(request: Request, topic: str):
+        """Stream events published on `topic` to one client as server-sent events."""
+        queue = event_bus.subscribe(topic)
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15.0)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream.
+                    yield ": keep-alive\n\n"
+                    continue
+                yield event.to_sse()
+        finally:
+            event_bus.unsubscribe(topic, queue)
+
+    def _sse_response(request: Request, topic: str) -> StreamingResponse:
+        return StreamingResponse(
+            _event_stream(request, topic),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def _get_app_or_raise(app_id: str, use_cache: bool = True, parts: frozenset[str] = APP_PARTS) -> SandboxApp:
+        sandbox_app = await app_directory.get_app(app_id, use_cache, parts)
         if not sandbox_app:
             raise HTTPException(status_code=404, detail="App not found")
         return sandbox_app
 
+    async def _get_metadata_or_raise(app_id: str) -> AppMetadata:
+        metadata = await app_directory.get_metadata(app_id)
+        if metadata is None:
+            raise HTTPException(status_code=404, detail="App not found")
+        return metadata
+
+    # Explanations still being generated for edits made on this container, by app id.
+    pending_explanations: dict[str, asyncio.Task] = {}
+
+    async def _attach_explanation(
+        app_id: str, edit_lock: EditLock, explanation_task: asyncio.Task, compaction_task: Optional[asyncio.Task] = None
+    ) -> None:
+        try:
+            explanation = await explanation_task
+            summary = None
+            if compaction_task is not None:
+                try:
+                    summary = await compaction_task
+                except Exception as e:
+                    print(f"Error summarizing history of app {app_id}: {str(e)}")
+            await app_directory.append_message(app_id, Message(content=explanation, type=MessageType.ASSISTANT), summary)
+            print(f"Attached explanation to app {app_id}")
+        except Exception as e:
+            print(f"Error attaching explanation to app {app_id}: {str(e)}")
+        finally:
+            # Runs after every edit, once its last LLM call is done.
+            await publish_llm_metrics(llm_metrics_dict)
+            await publish_routing_stats(routing_dict)
+            # The next edit must load the history with this explanation in it, so the app stays held until now.
+            await edit_lock.release()
+            if pending_explanations.get(app_id) is asyncio.current_task():
+                del pending_explanations[app_id]
+
+    async def _finish_edit(app: SandboxApp, edit_lock: EditLock, previous: str) -> None:
+        """Save an edited app, then save its explanation (and any history summary) in the background once generated.
+
+        The explanation task takes over `edit_lock` and releases it when done. If the save fails, the
+        sandbox gets `previous` (the stored component) back, the background calls are cancelled and the
+        error is raised, leaving `edit_lock` to the caller.
+        """
+        try:
+            await app_directory.save_edit(app)
+        except Exception:
+            for task in (app.explanation_task, app.compaction_task):
+                if task is not None:
+                    task.cancel()
+            # Not saved: put the stored component back so the sandbox doesn't diverge from it.
+            try:
+                await app.rollback(previous, "undo")
+            except Exception as e:
+                print(f"Failed to restore the component of app {app.id} after a failed edit: {e}")
+            raise
+        if app.explanation_task is None:
+            await edit_lock.release()
+            return
+        pending_explanations[app.id] = asyncio.create_task(
+            _attach_explanation(app.id, edit_lock, app.explanation_task, app.compaction_task)
+        )
+
+    def _conflict_response(e: Exception) -> JSONResponse:
+        """409 for an edit that lost a write race or waited too long behind other edits of the app."""
+        retry_after = int(EDIT_LOCK_WAIT) if isinstance(e, LockTimeout) else 1
+        return JSONResponse(
+            {"status": "error", "message": str(e), "retry_after": retry_after},
+            status_code=409,
+            headers={"Retry-After": str(retry_after)},
+        )
+
     @web_app.exception_handler(404)
     async def not_found_handler(request: Request, exc):
         return templates.TemplateResponse(
@@ -158,30 +343,44 @@ def fastapi_app():
         print("Fetching home page")
         apps_dict = await _get_apps_dict()
         return templates.TemplateResponse(
-            name="pages/home.html", context={"request": request, "apps": apps_dict}
+            name="pages/home.html",
+            context={"request": request, "apps": apps_dict, "apps_version": app_directory.version or 0},
         )
 
+    # Listing payload built from the cached catalogue, rebuilt only when the catalogue version changes.
+    apps_listing = {"version": None, "apps": {}, "body": b"", "etag": ""}
+
+    def _listing_entry(app_metadata) -> dict:
+        return {
+            "url": app_metadata.sandbox_user_tunnel_url,
+            "title": app_metadata.title if hasattr(app_metadata, 'title') else "",
+            "is_featured": app_metadata.is_featured if hasattr(app_metadata, 'is_featured') else False
+        }
+
+    def _etag_matches(request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get("if-none-match", "")
+        return etag in [tag.strip() for tag in if_none_match.split(",")]
+
     async def _get_apps_dict():
-        # app_directory already loaded on startup
+        # app_directory already loaded on startup; this costs at most one version read per TTL.
         # TODO(joy): Passing in the client is unclean, figure out a better way to do this.
         # async with httpx.AsyncClient() as client:
         #     await app_directory.cleanup(client)
-        app_directory.load()
-        apps_dict = {}
-        count = 0
-        for app_id, app_metadata in app_directory.apps.items():
-            count += 1
-            apps_dict[app_id] = {
-                "url": app_metadata.sandbox_user_tunnel_url,
-                "title": app_metadata.title if hasattr(app_metadata, 'title') else "",
-                "is_featured": app_metadata.is_featured if hasattr(app_metadata, 'is_featured') else False
-            }
+        await app_directory.refresh()
+        if apps_listing["version"] is not None and apps_listing["version"] == app_directory.version:
+            return apps_listing["apps"]
+        apps_dict = {app_id: _listing_entry(app_metadata) for app_id, app_metadata in app_directory.apps.items()}
+        body = json.dumps({"apps": apps_dict, "version": app_directory.version}).encode()
+        apps_listing["version"] = app_directory.version
+        apps_listing["apps"] = apps_dict
+        apps_listing["body"] = body
+        apps_listing["etag"] = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
         return apps_dict
         
 
     @web_app.get("/app/{app_id}")
     async def app_page(request: Request, app_id: str):
-        app = _get_app_or_raise(app_id)
+        app = await _get_app_or_raise(app_id, parts=frozenset({HISTORY_PART}))
         return templates.TemplateResponse(
             name="pages/app.html",
             context={
@@ -196,25 +395,216 @@ def fastapi_app():
         )
 
     @web_app.get("/api/apps")
-    async def get_apps():
-        """Get the list of all apps for live updates"""
+    async def get_apps(request: Request, since: Optional[int] = None):
+        """Get the list of all apps for live updates.
+
+        With `since` (a version from a previous response) only the apps added, updated or removed after
+        it are returned, unless the cursor is too old and `full` is set. Without it the full listing is
+        returned with a strong ETag. Either way a matching `If-None-Match` is answered with 304, so a
+        poll with an up-to-date cursor costs one version check.
+        """
+        if since is not None:
+            await app_directory.refresh()
+            # A delta depends only on the cursor and the catalogue version it is computed at.
+            etag = f'"delta-{since}-{app_directory.version}"'
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if app_directory.version is not None and _etag_matches(request, etag):
+                return Response(status_code=304, headers=headers)
+            if app_directory.version is not None and since >= app_directory.version:
+                return JSONResponse(
+                    {"full": False, "version": app_directory.version, "apps": {}, "removed": []}, headers=headers
+                )
+            changes = app_directory.changes_since(since)
+            if changes is not None:
+                updated, removed = changes
+                return JSONResponse({
+                    "full": False,
+                    "version": app_directory.version,
+                    "apps": {app_id: _listing_entry(app_metadata) for app_id, app_metadata in updated.items()},
+                    "removed": removed,
+                }, headers=headers)
+            print(f"[API /api/apps] Cursor {since} is too old, returning the full listing")
+            apps_dict = await _get_apps_dict()
+            return JSONResponse({"full": True, "version": app_directory.version, "apps": apps_dict, "removed": []})
+
         apps_dict = await _get_apps_dict()
+        etag = apps_listing["etag"]
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag and _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
         print(f"[API /api/apps] Returning {len(apps_dict)} apps")
-        return JSONResponse({"apps": apps_dict})
+        return Response(content=apps_listing["body"], media_type="application/json", headers=headers)
+
+    @web_app.get("/api/events")
+    async def gallery_events(request: Request):
+        """Push a `catalogue` event whenever apps are added, updated or removed."""
+        return _sse_response(request, GALLERY_TOPIC)
+
+    @web_app.get("/api/app/{app_id}/events")
+    async def app_events(request: Request, app_id: str):
+        """Push `status` and `message` events for a single app."""
+        await _get_metadata_or_raise(app_id)
+        return _sse_response(request, app_id)
+
+    @web_app.get("/api/llm/cache")
+    async def get_prompt_cache_stats():
+        """Prompt cache usage of the LLM calls made by this container."""
+        return JSONResponse(prompt_cache_stats.to_dict())
+
+    @web_app.get("/api/llm/metrics")
+    async def get_llm_metrics(scope: str = "all"):
+        """Latency, time-to-first-token, token and cost histograms of LLM calls, by model and purpose.
+
+        `scope=process` covers only this container; the default merges the snapshots published by every
+        controller container and by the create function.
+        """
+        if scope == "process":
+            return JSONResponse(llm_metrics.to_dict())
+        await publish_llm_metrics(llm_metrics_dict)
+        return JSONResponse((await collect_llm_metrics(llm_metrics_dict)).to_dict())
+
+    @web_app.get("/api/llm/routing")
+    async def get_routing_stats(scope: str = "all", recent: int = 50):
+        """How follow-up edits were routed between the fast and full models, and how they turned out.
+
+        Outcomes are grouped by tier and by what decided it, alongside the latest decisions with the
+        signals they were scored on. `scope=process` covers only this container.
+        """
+        if scope == "process":
+            return JSONResponse(routing_stats.to_dict(recent))
+        await publish_routing_stats(routing_dict)
+        return JSONResponse((await collect_routing_stats(routing_dict)).to_dict(recent))
+
+    @web_app.get("/api/cache/components")
+    async def get_component_cache_stats():
+        """Hit rate and size of the shared initial component cache."""
+        return JSONResponse(await ComponentCache(component_cache_dict).stats())
+
+    @web_app.post("/api/create", response_model=CreateAppResponse, status_code=202)
+    async def create_app(request_data: CreateAppRequest, request: Request, response: Response) -> CreateAppResponse:
+        """Start creating an app and return its job right away; follow it at /api/jobs/{job_id}."""
+        # Joins the caller's trace if it sent a traceparent header, so load tests can correlate their requests.
+        trace = start_trace(*parse_traceparent(request.headers.get(TRACEPARENT_HEADER)))
+        response.headers["X-Trace-Id"] = trace.trace_id
+        request_key = request_data.request_key or request.headers.get("Idempotency-Key")
+        jobs = CreateJobs(jobs_dict)
+        admission = AdmissionController(admission_dict)
+        try:
+            with span("api.create"):
+                try:
+                    job, created = await jobs.create(request_data.prompt, request_key, traceparent())
+                except LockTimeout:
+                    return JSONResponse(
+                        {"error": "A create with this request key is in progress", "retry_after": 1},
+                        status_code=409,
+                        headers={"Retry-After": "1", "X-Trace-Id": trace.trace_id},
+                    )
+                if created:
+                    try:
+                        # Queued jobs are started as slots free up, by the create that frees one or the cleanup job.
+                        await admission.enqueue(job["job_id"], await _live_sandbox_count(), start_create_job)
+                    except AdmissionRejected as e:
+                        await jobs.update(job["job_id"], phase="rejected", status=JobStatus.FAILED, error=e.reason)
+                        return JSONResponse(
+                            {"error": e.reason, "job_id": job["job_id"], "retry_after": e.retry_after},
+                            status_code=429,
+                            headers={"Retry-After": str(e.retry_after), "X-Trace-Id": trace.trace_id},
+                        )
+                    job = await jobs.get(job["job_id"]) or job
+        finally:
+            await TraceStore(traces_dict).save(trace)
+        if not created:
+            response.status_code = 200
+        response.headers["Location"] = f"/api/jobs/{job['job_id']}"
+        return CreateAppResponse(job_id=job["job_id"], status=job["status"], app_id=job["app_id"])
+
+    async def _live_sandbox_count() -> int:
+        """Sandboxes serving apps plus the warm ones waiting in the pool."""
+        _, pooled = await asyncio.gather(app_directory.refresh(), SandboxPool(sandbox_pool_queue, app, sandbox_image).size())
+        return pooled + sum(1 for metadata in app_directory.apps.values() if metadata.status != AppStatus.TERMINATED)
+
+    async def _get_job_or_raise(job_id: str) -> dict:
+        job = await CreateJobs(jobs_dict).get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job["status"] == JobStatus.CREATED.value:
+            # Still waiting for an admission slot: say where it is in the queue.
+            admission = AdmissionController(admission_dict)
+            position = await admission.position(job_id)
+            job["queue_position"] = position
+            job["estimated_wait_sec"] = admission.estimated_wait(position) if position else None
+        return job
+
+    @web_app.get("/api/admission")
+    async def get_admission_stats():
+        """Creates queued and in flight across all controller containers, and the configured limits."""
+        return JSONResponse(await AdmissionController(admission_dict).stats())
+
+    @web_app.get("/api/jobs/{job_id}")
+    async def get_job(job_id: str):
+        """Status, current phase and phase history of a create job; `app_id` is set once it is active."""
+        job = await _get_job_or_raise(job_id)
+        return JSONResponse(job, headers={"Cache-Control": "no-cache"})
+
+    @web_app.get("/api/jobs/{job_id}/events")
+    async def get_job_events(request: Request, job_id: str):
+        """Push a `job` event whenever a create job changes, until it is active or failed."""
+        job = await _get_job_or_raise(job_id)
+
+        async def stream_job():
+            nonlocal job
+            yield "retry: 3000\n\n"
+            last_update = None
+            while not await request.is_disconnected():
+                if (job["updated_at"], job.get("queue_position")) != last_update:
+                    last_update = (job["updated_at"], job.get("queue_position"))
+                    yield Event("job", job).to_sse()
+                if job["status"] in (JobStatus.ACTIVE.value, JobStatus.FAILED.value):
+                    return
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                try:
+                    job = await _get_job_or_raise(job_id)
+                except HTTPException:
+                    return
+
+        return StreamingResponse(
+            stream_job(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @web_app.get("/api/traces/summary")
+    async def get_trace_summary(limit: int = 200):
+        """p50/p95 duration of each create-app phase over the most recent `limit` traces."""
+        return JSONResponse(await TraceStore(traces_dict).summary(limit))
 
-    @web_app.post("/api/create", response_model=CreateAppResponse)
-    async def create_app(request_data: CreateAppRequest) -> CreateAppResponse:
-        app_id = await create_sandbox_app.remote.aio(request_data.prompt)
-        return CreateAppResponse(app_id=app_id)
+    @web_app.get("/api/traces/{trace_id}")
+    async def get_trace(trace_id: str):
+        spans = await TraceStore(traces_dict).get(trace_id)
+        if not spans:
+            raise HTTPException(status_code=404, detail="Trace not found")
+        return JSONResponse({"trace_id": trace_id, "spans": sorted(spans, key=lambda record: record["started_at"])})
 
     @web_app.post("/api/app/{app_id}/write")
     async def write_app(app_id: str, request_data: WriteAppRequest):
-        app = _get_app_or_raise(app_id)
+        # Edits to one app run one at a time, each holding the app until its explanation is saved.
+        edit_lock = app_directory.edit_lock(app_id)
+        try:
+            await edit_lock.acquire()
+        except LockTimeout as e:
+            return _conflict_response(e)
+        try:
+            # Edits save the whole history back, so they start from a fresh read rather than the cache.
+            app = await _get_app_or_raise(app_id, use_cache=False)
+        except BaseException:
+            await edit_lock.release()
+            raise
         try:
             print(f"Starting edit for app {app_id} with text: {request_data.text[:100] if request_data.text else ''}...")
+            previous = app.data.current_component
             response = await app.edit(request_data.text)
             print(f"Edit completed, response status: {response.status_code}")
-            app_directory.set_app(app)
+            await _finish_edit(app, edit_lock, previous)
             
             # Try to parse JSON response, handle both sync and async json() methods
             try:
@@ -232,16 +622,61 @@ def fastapi_app():
                 response_data = {"status": "ok"}
                 
             return JSONResponse(response_data, status_code=response.status_code)
+        except (WriteConflict, LockTimeout) as e:
+            print(f"Edit of app {app_id} was not saved: {str(e)}")
+            await edit_lock.release()
+            return _conflict_response(e)
         except Exception as e:
             print(f"Error writing to relay with data: {request_data}: {str(e)}")
             import traceback
             traceback.print_exc()
+            await edit_lock.release()
             return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
+    @web_app.post("/api/app/{app_id}/write/stream")
+    async def write_app_stream(app_id: str, request_data: WriteAppRequest):
+        """Same as /write, but streams the edit as newline-delimited JSON events while it is generated."""
+        await _get_metadata_or_raise(app_id)
+
+        async def stream_edit():
+            # Taken inside the stream so the lock is released however the response ends.
+            edit_lock = app_directory.edit_lock(app_id)
+            handed_off = False
+            try:
+                await edit_lock.acquire()
+                app = await app_directory.get_app(app_id, use_cache=False)
+                if app is None:
+                    yield json.dumps({"type": "error", "message": "App not found"}) + "\n"
+                    return
+                print(f"Starting streamed edit for app {app_id} with text: {request_data.text[:100] if request_data.text else ''}...")
+                previous = app.data.current_component
+                async for event in app.edit_stream(request_data.text):
+                    if event["type"] == "done":
+                        await _finish_edit(app, edit_lock, previous)
+                        handed_off = True
+                    yield json.dumps(event) + "\n"
+            except (WriteConflict, LockTimeout) as e:
+                print(f"Streamed edit of app {app_id} was not saved: {str(e)}")
+                yield json.dumps({"type": "error", "message": str(e), "conflict": True}) + "\n"
+            except Exception as e:
+                print(f"Error streaming edit for app {app_id}: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+            finally:
+                if not handed_off:
+                    await edit_lock.release()
+
+        return StreamingResponse(
+            stream_edit(),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     @web_app.get("/api/app/{app_id}/history")
     async def get_message_history(app_id: str):
         """Get the message history for an app"""
-        app = _get_app_or_raise(app_id)
+        app = await _get_app_or_raise(app_id, parts=frozenset({HISTORY_PART}))
         history_data = [
             {"content": msg.content, "type": msg.type.value}
             for msg in app.data.message_history
@@ -256,29 +691,114 @@ def fastapi_app():
             }
         )
 
+    async def _get_revision_or_raise(app_id: str, ref: str, index: dict) -> tuple[str, str]:
+        digest = ComponentRevisions.resolve(index, ref)
+        component = await app_directory.revisions.get(app_id, digest, index) if digest is not None else None
+        if component is None:
+            raise HTTPException(status_code=404, detail="Revision not found")
+        return digest, component
+
+    @web_app.get("/api/app/{app_id}/revisions")
+    async def list_revisions(app_id: str):
+        """List an app's component revisions, newest first."""
+        await _get_metadata_or_raise(app_id)
+        index = await app_directory.revisions.index(app_id)
+        entries = index["entries"]
+        return JSONResponse({
+            "current": entries[-1]["hash"] if entries else None,
+            "revisions": [{**entry, "size": index["blobs"][entry["hash"]]["size"]} for entry in reversed(entries)],
+        })
+
+    @web_app.get("/api/app/{app_id}/revisions/diff")
+    async def diff_revisions(app_id: str, base: str, target: Optional[str] = None):
+        """Unified diff from revision `base` to revision `target` (by default, the current one)."""
+        await _get_metadata_or_raise(app_id)
+        index = await app_directory.revisions.index(app_id)
+        if target is None:
+            if not index["entries"]:
+                raise HTTPException(status_code=404, detail="Revision not found")
+            target = index["entries"][-1]["hash"]
+        (base_digest, base_component), (target_digest, target_component) = await asyncio.gather(
+            _get_revision_or_raise(app_id, base, index), _get_revision_or_raise(app_id, target, index)
+        )
+        return JSONResponse({
+            "base": base_digest,
+            "target": target_digest,
+            "diff": revision_diff(base_component, target_component, base_digest[:8], target_digest[:8]),
+        })
+
+    @web_app.get("/api/app/{app_id}/revisions/{revision}")
+    async def get_revision(app_id: str, revision: str):
+        """The component source of one revision."""
+        await _get_metadata_or_raise(app_id)
+        index = await app_directory.revisions.index(app_id)
+        digest, component = await _get_revision_or_raise(app_id, revision, index)
+        return JSONResponse({"hash": digest, "component": component})
+
+    @web_app.post("/api/app/{app_id}/rollback")
+    async def rollback_app(app_id: str, request_data: RollbackAppRequest):
+        """Restore an earlier component revision, pushing it straight to the sandbox without an LLM call."""
+        started = time.monotonic()
+        edit_lock = app_directory.edit_lock(app_id)
+        try:
+            await edit_lock.acquire()
+        except LockTimeout as e:
+            return _conflict_response(e)
+        try:
+            app, index = await asyncio.gather(
+                _get_app_or_raise(app_id, use_cache=False), app_directory.revisions.index(app_id)
+            )
+            digest, component = await _get_revision_or_raise(app_id, request_data.revision, index)
+            previous = app.data.current_component
+            response = await app.rollback(component, f"revision {digest[:8]}")
+            try:
+                # Metadata writes that landed since the read are kept; the rollback is re-applied on top.
+                await app_directory.save_edit(app, revision_note=f"Rolled back to {digest[:8]}")
+            except Exception:
+                # Not saved: put the stored component back so the sandbox doesn't diverge from it.
+                try:
+                    await app.rollback(previous, "undo")
+                except Exception as e:
+                    print(f"Failed to restore the component of app {app_id} after a failed rollback: {e}")
+                raise
+            duration = time.monotonic() - started
+            print(f"Rolled back app {app_id} to revision {digest} in {duration:.3f}s")
+            return JSONResponse(
+                {"status": "success", "revision": digest, "duration_sec": round(duration, 3)},
+                status_code=response.status_code,
+            )
+        except (WriteConflict, LockTimeout) as e:
+            return _conflict_response(e)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error rolling back app {app_id}: {str(e)}")
+            return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+        finally:
+            await edit_lock.release()
+
     @web_app.get("/api/app/{app_id}/status")
     async def get_app_status(app_id: str):
         """Return the current metadata status for the requested app without pinging the sandbox."""
-        app = _get_app_or_raise(app_id)
-        return JSONResponse({"status": app.metadata.status.value})
+        metadata = await _get_metadata_or_raise(app_id)
+        return JSONResponse({"status": metadata.status.value})
 
     @web_app.get("/api/app/{app_id}/ping")
     async def ping_app(app_id: str):
-        app = _get_app_or_raise(app_id)
+        app = await _get_app_or_raise(app_id, parts=frozenset())
         heartbeat_url = f"{app.data.sandbox_tunnel_url}/heartbeat"
         try:
             print(f"Pinging relay at: {heartbeat_url}")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(heartbeat_url, timeout=2.0)
-                print(f"Ping response status: {response.status_code}")
-                # Handle both sync and async json() methods
-                import inspect
-                json_method = response.json()
-                if inspect.iscoroutine(json_method):
-                    response_data = await json_method
-                else:
-                    response_data = json_method
-                return JSONResponse(response_data, status_code=response.status_code)
+            response = await get_http_client().get(heartbeat_url, timeout=2.0)
+            print(f"Ping response status: {response.status_code}")
+            # Handle both sync and async json() methods
+            import inspect
+            json_method = response.json()
+            if inspect.iscoroutine(json_method):
+                response_data = await json_method
+            else:
+                response_data = json_method
+            return JSONResponse(response_data, status_code=response.status_code)
         except Exception as e:
             print(f"Error pinging relay: {str(e)}")
             return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
@@ -293,11 +813,11 @@ def fastapi_app():
         if request_data.admin_secret != admin_secret:
             return JSONResponse({"status": "error", "message": "Invalid admin secret"}, status_code=403)
         
-        app = _get_app_or_raise(app_id)
+        app = await _get_app_or_raise(app_id, parts=frozenset())
         try:
-            success = app.terminate()
+            success = await app.terminate()
             if success:
-                app_directory.remove_app(app_id)
+                await app_directory.remove_app(app_id)
                 return JSONResponse({"status": "success", "message": f"Sandbox {app_id} terminated successfully"})
             else:
                 return JSONResponse({"status": "error", "message": "Failed to terminate sandbox"}, status_code=500)
@@ -312,9 +832,9 @@ def fastapi_app():
         if not admin_secret or request_data.admin_secret != admin_secret:
             raise HTTPException(status_code=403, detail="Invalid admin secret")
         
-        app = _get_app_or_raise(app_id)
-        sandbox = modal.Sandbox.from_object_id(app.data.sandbox_object_id)
-        image = sandbox.snapshot_filesystem()
+        app = await _get_app_or_raise(app_id, parts=frozenset())
+        sandbox = await modal.Sandbox.from_id.aio(app.data.sandbox_object_id)
+        image = await sandbox.snapshot_filesystem.aio()
         return JSONResponse({"status": "success", "image": image.object_id}, status_code=200)
 
     @web_app.post("/api/app/{app_id}/toggle-feature")
@@ -324,19 +844,26 @@ def fastapi_app():
         if not admin_secret or request_data.admin_secret != admin_secret:
             raise HTTPException(status_code=403, detail="Invalid admin secret")
         
-        app = _get_app_or_raise(app_id)
-        
-        try:
+        await _get_metadata_or_raise(app_id)
+
+        def toggle(app: SandboxApp) -> None:
             app.metadata.is_featured = not getattr(app.metadata, 'is_featured', False)
             app.metadata.updated_at = datetime.now()
-            
-            app_directory.set_app(app)
+        
+        try:
+            app = await app_directory.update_app(app_id, toggle)
+            if app is None:
+                raise HTTPException(status_code=404, detail="App not found")
             
             return JSONResponse({
                 "status": "success", 
                 "is_featured": app.metadata.is_featured,
                 "message": f"App {app_id} is now {'featured' if app.metadata.is_featured else 'not featured'}"
             })
+        except HTTPException:
+            raise
+        except (WriteConflict, LockTimeout) as e:
+            return _conflict_response(e)
         except Exception as e:
             print(f"Error toggling feature status for {app_id}: {str(e)}")
             return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
@@ -351,33 +878,35 @@ def fastapi_app():
         if request_data.admin_secret != admin_secret:
             return JSONResponse({"status": "error", "message": "Invalid admin secret"}, status_code=403)
         
-        app_directory.load()  # Ensure we have the latest apps
-        apps = app_directory.apps.keys()
-        terminated_count = 0
-        failed_count = 0
-        apps_copy = list(apps)
+        await app_directory.load()  # Ensure we have the latest apps
+        apps_copy = list(app_directory.apps.keys())
+        semaphore = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+
+        async def terminate_one(app_id: str) -> Optional[bool]:
+            async with semaphore:
+                try:
+                    sandbox_app = await app_directory.get_app(app_id, parts=frozenset())
+                    if not sandbox_app:
+                        print(f"❌ App {app_id} not found in catalogue")
+                        return None
+                    success = await sandbox_app.terminate()
+                    if success:
+                        print(f"✅ Terminated sandbox: {app_id}")
+                    else:
+                        print(f"❌ Failed to terminate sandbox: {app_id}")
+                    return success
+                except Exception as e:
+                    print(f"❌ Error terminating sandbox {app_id}: {str(e)}")
+                    return False
+
+        results = await asyncio.gather(*(terminate_one(app_id) for app_id in apps_copy))
+        terminated_count = sum(1 for result in results if result is True)
+        failed_count = sum(1 for result in results if result is False)
+        await app_directory.remove_apps([app_id for app_id, result in zip(apps_copy, results) if result is not None])
         
-        for app_id in apps_copy:
-            try:
-                sandbox_app = app_directory.get_app(app_id)
-                if not sandbox_app:
-                    print(f"❌ App {app_id} not found in catalogue")
-                    continue
-                success = sandbox_app.terminate()
-                app_directory.remove_app(app_id)
-                if success:
-                    terminated_count += 1
-                    print(f"✅ Terminated sandbox: {app_id}")
-                else:
-                    failed_count += 1
-                    print(f"❌ Failed to terminate sandbox: {app_id}")
-            except Exception as e:
-                failed_count += 1
-                print(f"❌ Error terminating sandbox {app_id}: {str(e)}")
-        
-        for sandbox in modal.Sandbox.list(app_id=app.app_id):
+        async for sandbox in modal.Sandbox.list.aio(app_id=app.app_id):
             print(f"Sandbox: {sandbox.object_id}")
-            sandbox.terminate()
+            await sandbox.terminate.aio()
 
         return JSONResponse({
             "status": "success", 
@@ -390,13 +919,39 @@ def fastapi_app():
 
 @app.function(schedule=modal.Period(minutes=1))
 async def clean_up_dead_apps():
-    import httpx
-
     app_directory = AppDirectory(apps_dict, app, llm_client)
-    app_directory.load()  # Load apps for cleanup
-    # TODO(joy): I do not like how these async clients are created. Unclean.
-    # Use more resilient client settings for cleanup
-    limits = httpx.Limits(max_keepalive_connections=10, max_connections=20)
-    timeout = httpx.Timeout(timeout=30.0, connect=10.0, read=10.0)
-    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
-        await app_directory.cleanup(client)
+    try:
+        summary = await app_directory.cleanup(get_http_client())
+        # Also reclaims slots of creates that never released theirs and starts queued jobs with them.
+        await AdmissionController(admission_dict).dispatch(start_create_job)
+        return summary
+    finally:
+        # Runs are a minute apart, longer than connections are kept alive, so don't hold them in between.
+        await close_http_client()
+
+
+@app.function(schedule=modal.Period(minutes=1), max_containers=1, timeout=600)
+async def refill_sandbox_pool():
+    """Expire stale warm sandboxes and boot new ones up to the pool's target size.
+
+    Also spawned by create_sandbox_app when a claim leaves the pool below its minimum; a single
+    container runs refills one at a time so concurrent triggers can't overshoot the maximum.
+    """
+    pool = SandboxPool(sandbox_pool_queue, app, sandbox_image)
+    try:
+        return await pool.refill(get_http_client())
+    finally:
+        await close_http_client()
+
+
+@app.local_entrypoint()
+async def trace_report(output: str = "traces.jsonl", limit: int = 1000):
+    """Export recent create-app traces to a JSONL file and print p50/p95 per phase."""
+    store = TraceStore(traces_dict)
+    count = await store.export_jsonl(output, limit)
+    print(f"Wrote {count} spans to {output}")
+    with open(output) as f:
+        phases = summarize(json.loads(line) for line in f)
+    print(f"{'phase':<32} {'count':>6} {'p50 (s)':>9} {'p95 (s)':>9} {'max (s)':>9}")
+    for name, stats in phases.items():
+        print(f"{name:<32} {stats['count']:>6} {stats['p50']:>9.3f} {stats['p95']:>9.3f} {stats['max']:>9.3f}")
@@ -4,7 +4,9 @@ This is a simple FastAPI server that can be used to test the sandbox server.
 This file is read in by the sandbox server and executed in the sandbox.
 """
 
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
@@ -29,16 +31,22 @@ class EditRequest(BaseModel):
 
 
 @fastapi_app.post("/edit")
-async def edit_text(request: EditRequest):
+async def edit_text(request: EditRequest, http_request: Request, response: Response):
     global display_html
+    # Trace context of the controller request that sent this edit, logged so sandbox logs can be joined to it.
+    trace = http_request.headers.get("traceparent")
+    if trace:
+        print(f"traceparent: {trace}")
     llm_react_app = request.component
     if not is_component_valid(llm_react_app):
         print(f"Invalid component: {llm_react_app}")
         return {"status": "error", "message": "Invalid component"}
 
     print(f"Existing component: {llm_react_app}")
+    started = time.monotonic()
     with open("/root/vite-app/src/LLMComponent.tsx", "w+") as f:
         f.write(llm_react_app)
+    response.headers["Server-Timing"] = f"write_component;dur={(time.monotonic() - started) * 1000:.3f}"
     print(f"Component edited to: {llm_react_app}")
     return {"status": "ok"}
 
@@ -1,22 +1,54 @@
+import asyncio
+
 import modal
 
+from core.tracing import span
+
 SANDBOX_TIMEOUT = 86400  # 24 hours
+READY_MARKER = "SANDBOX_READY"  # Printed by startup.sh once FastAPI and Vite both answer.
+READY_TIMEOUT = 60.0
+
+
+async def wait_for_ready_signal(sb: modal.Sandbox, timeout: float = READY_TIMEOUT) -> bool:
+    """Wait for startup.sh to announce on stdout that both servers are up.
+
+    Returns False if the sandbox exits or stays silent for `timeout` seconds.
+    """
+    async def read_until_marker() -> bool:
+        buffer = ""
+        async for chunk in sb.stdout:
+            buffer = (buffer + chunk)[-4096:]
+            if READY_MARKER in buffer:
+                return True
+        return False
 
-async def run_sandbox_server_with_tunnel(app: modal.App, image: modal.Image):
-    """Create and run a sandbox with an HTTP server exposed via tunnel"""
+    try:
+        return await asyncio.wait_for(read_until_marker(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return False
+
+
+async def run_sandbox_server_with_tunnel(app: modal.App, image: modal.Image, wait_until_ready: bool = True):
+    """Create and run a sandbox with an HTTP server exposed via tunnel.
+
+    Returns `(main_url, user_url, object_id, ready)`, where `ready` says whether the sandbox signalled
+    that its servers are up (always False when `wait_until_ready` is off).
+    """
     print("🚀 Creating sandbox...")
-    sb = await modal.Sandbox.create.aio(
-        "/bin/bash",
-        "/root/startup.sh",
-        image=image,
-        app=app,
-        timeout=SANDBOX_TIMEOUT,
-        encrypted_ports=[8000, 5173],
-    )
+    with span("sandbox.create"):
+        sb = await modal.Sandbox.create.aio(
+            "/bin/bash",
+            "/root/startup.sh",
+            image=image,
+            app=app,
+            timeout=SANDBOX_TIMEOUT,
+            encrypted_ports=[8000, 5173],
+        )
     print(f"📋 Created sandbox with ID: {sb.object_id}")
 
     print("⏳ Waiting for tunnels to establish...")    
-    tunnels = await sb.tunnels.aio()
+    with span("sandbox.tunnels"):
+        tunnels = await sb.tunnels.aio()
     main_tunnel = tunnels[8000]
     user_tunnel = tunnels[5173]
     print("\n🚀 Creating HTTP Server with tunnel!")
@@ -31,5 +63,12 @@ async def run_sandbox_server_with_tunnel(app: modal.App, image: modal.Image):
     print(f"🌐 Frontend URL: {user_tunnel.url} <-- Open this in your browser!")
     print(f"🔒 TLS Socket: {user_tunnel.tls_socket}")
 
+    ready = False
+    if wait_until_ready:
+        with span("sandbox.ready_signal") as attributes:
+            ready = await wait_for_ready_signal(sb)
+            attributes["ready"] = ready
+        print(f"{'✅' if ready else '❌'} Sandbox {sb.object_id} ready signal: {ready}")
+
     print("Sandbox server with tunnel running")
-    return main_tunnel.url, user_tunnel.url, sb.object_id
+    return main_tunnel.url, user_tunnel.url, sb.object_id, ready
@@ -1,6 +1,9 @@
 #!/bin/bash
 set -e
 
+# Printed once both services answer locally; the controller waits for this line on the sandbox's stdout.
+READY_MARKER="SANDBOX_READY"
+
 echo "🚀 Starting sandbox services..."
 
 # Start FastAPI server in background with logs
@@ -17,38 +20,29 @@ pnpm exec vite --host 0.0.0.0 --port 5173 > /tmp/vite.log 2>&1 &
 VITE_PID=$!
 echo "Vite started with PID: $VITE_PID"
 
-# Give services a moment to start
-sleep 3
-
-# Check if processes are still running
-echo "Checking if services are running..."
-if ps -p $FASTAPI_PID > /dev/null; then
-    echo "✅ FastAPI process is running"
-else
-    echo "❌ FastAPI process died! Log:"
-    cat /tmp/fastapi.log
-    exit 1
-fi
+# Poll in short steps, bailing out as soon as either process dies
+echo "⏳ Waiting for services to be ready..."
+for i in {1..240}; do
+    if ! ps -p $FASTAPI_PID > /dev/null; then
+        echo "❌ FastAPI process died! Log:"
+        cat /tmp/fastapi.log
+        exit 1
+    fi
 
-if ps -p $VITE_PID > /dev/null; then
-    echo "✅ Vite process is running"
-else
-    echo "❌ Vite process died! Log:"
-    cat /tmp/vite.log
-    exit 1
-fi
+    if ! ps -p $VITE_PID > /dev/null; then
+        echo "❌ Vite process died! Log:"
+        cat /tmp/vite.log
+        exit 1
+    fi
 
-# Simple health check - just see if ports are open
-echo "⏳ Waiting for services to be ready..."
-for i in {1..30}; do
     # Check FastAPI
-    if curl -s http://localhost:8000/heartbeat > /dev/null 2>&1; then
+    if [ "$FASTAPI_READY" != "true" ] && curl -s http://localhost:8000/heartbeat > /dev/null 2>&1; then
         echo "✅ FastAPI is ready!"
         FASTAPI_READY=true
     fi
     
     # Check Vite
-    if curl -s http://localhost:5173 > /dev/null 2>&1; then
+    if [ "$VITE_READY" != "true" ] && curl -s http://localhost:5173 > /dev/null 2>&1; then
         echo "✅ Vite is ready!"
         VITE_READY=true
     fi
@@ -56,11 +50,12 @@ for i in {1..30}; do
     # Both ready?
     if [ "$FASTAPI_READY" = "true" ] && [ "$VITE_READY" = "true" ]; then
         echo "🎉 All services started successfully!"
+        echo "$READY_MARKER"
         break
     fi
     
-    if [ $i -eq 30 ]; then
-        echo "❌ Services failed to start after 30 attempts"
+    if [ $i -eq 240 ]; then
+        echo "❌ Services failed to start after 60 seconds"
         echo "FastAPI log:"
         cat /tmp/fastapi.log
         echo "Vite log:"
@@ -68,8 +63,7 @@ for i in {1..30}; do
         exit 1
     fi
     
-    echo "Attempt $i/30: Waiting for services..."
-    sleep 2
+    sleep 0.25
 done
 
 # Keep the script running
@@ -0,0 +1,48 @@
+import pytest
+
+from core.patch import DIVIDER, REPLACE_MARKER, SEARCH_MARKER, PatchError, apply_patch
+
+COMPONENT = """import React from 'react';
+export default function LLMComponent() {
+    return (
+        <div className="bg-red-500">
+            <h1>Title</h1>
+        </div>
+    )
+}"""
+
+
+def hunk(search: str, replace: str) -> str:
+    return f"{SEARCH_MARKER}\n{search}{DIVIDER}\n{replace}{REPLACE_MARKER}\n"
+
+
+def test_applies_hunk():
+    patched = apply_patch(COMPONENT, hunk("            <h1>Title</h1>\n", "            <h1>New title</h1>\n"))
+    assert patched == COMPONENT.replace("Title", "New title")
+
+
+def test_edits_last_line_of_unterminated_source():
+    patch = hunk("    )\n}\n", "    )\n}\n\nconst answer = { value: 42 };\n")
+    patched = apply_patch(COMPONENT, patch)
+    assert patched == COMPONENT + "\n\nconst answer = { value: 42 };"
+
+
+def test_keeps_trailing_newline_of_terminated_source():
+    patched = apply_patch(COMPONENT + "\n", hunk("}\n", "}\n// end\n"))
+    assert patched == COMPONENT + "\n// end\n"
+
+
+def test_rejects_ambiguous_search_block():
+    source = COMPONENT.replace("<h1>Title</h1>", "<h1>Title</h1>\n            <h1>Title</h1>")
+    with pytest.raises(PatchError, match="matches 2 times"):
+        apply_patch(source, hunk("            <h1>Title</h1>\n", "            <h1>New title</h1>\n"))
+
+
+def test_rejects_missing_search_block():
+    with pytest.raises(PatchError, match="matches 0 times"):
+        apply_patch(COMPONENT, hunk("            <h2>Missing</h2>\n", "            <h2>Found</h2>\n"))
+
+
+def test_accepts_full_rewrite():
+    rewrite = COMPONENT.replace("bg-red-500", "bg-blue-500")
+    assert apply_patch(COMPONENT, rewrite) == rewrite
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+# core.routing imports core.llm, which needs the Anthropic client, dotenv and (through tracing) modal.
+pytest.importorskip("anthropic")
+pytest.importorskip("dotenv")
+pytest.importorskip("modal")
+
+from core.routing import COMPLEX, LARGE_COMPONENT, SIMPLE, route_edit, score_edit
+
+COMPONENT = "export default function LLMComponent() { return <div>Hi</div> }"
+
+
+def route(message: str, component: str = COMPONENT):
+    # Heuristic decisions never call the classifier, so no client is needed.
+    return asyncio.run(route_edit(None, message, component))
+
+
+@pytest.mark.parametrize("message", [
+    "make the button blue",
+    "change the title text",
+    "fix the typo in the heading",
+    "make the font bigger and add more padding",
+])
+def test_cosmetic_edits_are_simple(message):
+    decision = route(message)
+    assert decision.tier == SIMPLE
+    assert decision.decided_by == "heuristic"
+
+
+@pytest.mark.parametrize("message", [
+    "add a full dashboard with charts",
+    "build a new page with a form and a table",
+])
+def test_structural_edits_are_complex(message):
+    decision = route(message)
+    assert decision.tier == COMPLEX
+    assert decision.decided_by == "heuristic"
+
+
+def test_borderline_edit_defaults_to_complex(monkeypatch):
+    monkeypatch.setattr("core.routing.ROUTER_CLASSIFIER", False)
+    decision = route("make it pop")
+    assert decision.score == 0
+    assert (decision.tier, decision.decided_by) == (COMPLEX, "default")
+
+
+def test_large_component_leans_complex():
+    small, _ = score_edit("make the button blue", COMPONENT)
+    large, signals = score_edit("make the button blue", "x" * (LARGE_COMPONENT + 1))
+    assert large == small + 1
+    assert signals["component_chars"] == LARGE_COMPONENT + 1